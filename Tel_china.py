@@ -4,12 +4,14 @@ import sys
 import asyncio
 import requests
 import urllib.parse
-import time
 import math
 import hashlib
 from bs4 import BeautifulSoup
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from woocommerce import API
+import woocommerce.api as woocommerce_api
 
 # --- CONFIGURACIÓN ---
 wcapi = API(
@@ -20,6 +22,23 @@ wcapi = API(
     timeout=60
 )
 
+# Reintentos con backoff exponencial (2, 4, 8, 16, 32 s) ante 429/5xx en una sesión
+# compartida; sustituye al bucle de reintentos con esperas fijas de 15 s.
+WC_RETRY = Retry(
+    total=5,
+    backoff_factor=2,
+    status_forcelist=[429, 500, 502, 503, 504],
+    # Sin POST: un alta que WooCommerce ya ha aplicado (timeout de lectura o
+    # 502/504 tras el commit) se reenviaría y crearía el producto duplicado.
+    allowed_methods=frozenset(["GET", "PUT", "DELETE"]),
+    raise_on_status=False,
+)
+wc_session = requests.Session()
+wc_session.mount("https://", HTTPAdapter(max_retries=WC_RETRY))
+wc_session.mount("http://", HTTPAdapter(max_retries=WC_RETRY))
+# woocommerce.API hace cada llamada con requests.request(): la redirigimos a la sesión.
+woocommerce_api.request = wc_session.request
+
 # --- AFILIADOS (poner el query completo en variables de entorno) ---
 # Ejemplos:
 #   AFF_ALIEXPRESS="dp=XXXX&aff_fcid=...&aff_fsk=...&aff_platform=...&sk=...&aff_trace_key=..."
@@ -137,6 +156,24 @@ def normalizar_url_aliexpress(url: str) -> str:
     return u.split("?")[0]
 
 
+# Tiendas donde queremos quitar query (búsqueda sin distinguir mayúsculas, sin copiar la URL)
+TIENDAS_SIN_QUERY = (
+    "pccomponentes.com",
+    "fnac.es",
+    "amazon.es",
+    "phonehouse.es",
+    "dhgate.com",
+    "tradingshenzhen.com",
+    "mi.com",
+    "powerplanetonline.com",
+    "gshopper.com",
+    "mediamarkt.",
+)
+RE_TIENDAS_SIN_QUERY = re.compile("|".join(map(re.escape, TIENDAS_SIN_QUERY)), re.I)
+RE_ALIEXPRESS = re.compile(r"aliexpress", re.I)
+RE_ALIEXPRESS_ITEM = re.compile(r"(https://[^\s]+aliexpress\.[^\s]+?/item/\d+\.html)", re.I)
+
+
 def limpiar_url_segun_fuente(url_exp: str) -> str:
     """Elimina query de tracking/afiliado original según dominio."""
     if not url_exp:
@@ -146,29 +183,16 @@ def limpiar_url_segun_fuente(url_exp: str) -> str:
     url_limpia = url_exp
 
     # AliExpress: reconstruimos canonical
-    if "aliexpress" in url_exp.lower():
+    if RE_ALIEXPRESS.search(url_exp):
         # a veces viene URL url-encoded dentro de otra
         if "https%3A%2F%2F" in url_exp:
             decoded = urllib.parse.unquote(url_exp)
-            m = re.search(r"(https://[^\s]+aliexpress\.[^\s]+?/item/\d+\.html)", decoded, re.I)
+            m = RE_ALIEXPRESS_ITEM.search(decoded)
             if m:
                 return normalizar_url_aliexpress(m.group(1))
         return normalizar_url_aliexpress(url_exp)
 
-    # tiendas donde queremos quitar query
-    tiendas_con_query = [
-        "pccomponentes.com",
-        "fnac.es",
-        "amazon.es",
-        "phonehouse.es",
-        "dhgate.com",
-        "tradingshenzhen.com",
-        "mi.com",
-        "powerplanetonline.com",
-        "gshopper.com",
-        "mediamarkt.",
-    ]
-    if any(tienda in url_exp.lower() for tienda in tiendas_con_query):
+    if RE_TIENDAS_SIN_QUERY.search(url_exp):
         url_limpia = url_exp.split("?")[0]
 
     # si por algún motivo viene con '...'
@@ -259,6 +283,16 @@ def obtener_o_crear_categoria_con_imagen(nombre_cat, parent_id=0):
         return 0, ""
 
 
+# Regex precompiladas de extraer_datos (se ejecuta por cada mensaje del canal)
+RE_LINEA_PRECIO = re.compile(r"\b\d+[\.,]?\d*\s*€\b")
+RE_SOLO_SIMBOLOS = re.compile(r"^[\W_]+$")
+RE_PREFIJO_NO_PALABRA = re.compile(r"^[^\w]+")
+RE_NO_ALNUM = re.compile(r"[^A-Za-z0-9]+")
+RE_GIGAS = re.compile(r"(\d+)\s*GB", re.I)
+RE_PRECIO = re.compile(r"(\d+[.,]?\d*)\s*€")
+RE_CUPON = re.compile(r"(?:Cod\.\s*Promo|Cupón|Código)\s*:?\s*([A-Z0-9]+)", re.I)
+
+
 def extraer_datos(texto):
     t_clean = texto.replace("**", "").replace("`", "").strip()
     lineas = [l.strip() for l in t_clean.split("\n") if l.strip()]
@@ -277,20 +311,20 @@ def extraer_datos(texto):
         # En Telegram, los campos suelen venir como "Precio:", "Cupón:", "Link:", etc.
         if ":" in s_str:
             return False
-        if re.search(r"\b\d+[\.,]?\d*\s*€\b", s_str):
+        if RE_LINEA_PRECIO.search(s_str):
             return False
         for k in ("precio", "cup", "cupón", "cupon", "link", "ram", "rom", "cn version", "eu version", "visita", "síguenos", "siguenos", "follow"):
             if low.startswith(k):
                 return False
         # Línea vacía/solo símbolos
-        if re.match(r"^[\W_]+$", s_str):
+        if RE_SOLO_SIMBOLOS.match(s_str):
             return False
         return True
 
     partes_nombre = []
     for linea in lineas:
         # Limpia bullets/emojis al inicio, pero conserva el resto tal cual
-        cand = re.sub(r"^[^\w]+", "", linea).strip()
+        cand = RE_PREFIJO_NO_PALABRA.sub("", linea).strip()
         if _es_parte_de_nombre(cand):
             partes_nombre.append(cand)
         elif partes_nombre:
@@ -311,7 +345,7 @@ def extraer_datos(texto):
     try:
         _parts = nombre.split()
         _first_raw = _parts[0] if _parts else ""
-        _first_clean = re.sub(r"[^A-Za-z0-9]+", "", _first_raw)
+        _first_clean = RE_NO_ALNUM.sub("", _first_raw)
         if _first_clean.upper().startswith("IQ") and not nombre.strip().lower().startswith("vivo "):
             if _parts:
                 _parts[0] = _first_clean.upper() if _first_clean else _parts[0].upper()
@@ -321,7 +355,7 @@ def extraer_datos(texto):
 
 
     # RAM / ROM
-    gigas = re.findall(r"(\d+)\s*GB", t_clean, re.I)
+    gigas = RE_GIGAS.findall(t_clean)
     memoria = f"{gigas[0]} GB" if len(gigas) >= 1 else "N/A"
     capacidad = f"{gigas[1]} GB" if len(gigas) >= 2 else "N/A"
     if memoria == "N/A" or capacidad == "N/A":
@@ -331,13 +365,13 @@ def extraer_datos(texto):
 
     # precio actual
     precio_actual = 0
-    m_p = re.search(r"(\d+[.,]?\d*)\s*€", t_clean)
+    m_p = RE_PRECIO.search(t_clean)
     if m_p:
         precio_actual = int(round(float(m_p.group(1).replace(",", "."))))
 
     # cupón
     codigo_de_descuento = "OFERTA: PROMO."
-    m_c = re.search(r"(?:Cod\.\s*Promo|Cupón|Código)\s*:?\s*([A-Z0-9]+)", t_clean, re.I)
+    m_c = RE_CUPON.search(t_clean)
     if m_c:
         codigo_de_descuento = m_c.group(1)
 
@@ -447,7 +481,7 @@ async def main():
 
 
     response = requests.get(url_canal, headers=headers, timeout=20)
-    soup = BeautifulSoup(response.text, "html.parser")
+    soup = BeautifulSoup(response.text, "lxml")
     mensajes = soup.find_all("div", class_="tgme_widget_message")
     print(f"Mensajes Telegram detectados: {len(mensajes)}")
     if len(mensajes) == 0:
@@ -576,28 +610,24 @@ async def main():
             ],
         }
 
-        # --- CREACIÓN CON REINTENTOS ---
-        intentos, max_intentos, creado = 0, 10, False
-        while intentos < max_intentos and not creado:
-            intentos += 1
-            try:
-                res = wcapi.post("products", data)
-                if res.status_code in [200, 201]:
-                    p_res = res.json()
-                    new_id = p_res["id"]
-                    plink_raw = p_res.get("permalink", "")
-                    plink_short = acortar_url(plink_raw) if plink_raw else ""
-                    if plink_short:
-                        wcapi.put(f"products/{new_id}", {"meta_data": [{"key": "url_post_acortada", "value": plink_short}]})
-                    summary_creados.append({"nombre": nombre, "id": new_id})
-
-                    print(f"✅ CREADO -> {nombre} (ID: {new_id})")
-                    print(f"14b) URL Post Acortada (WP): {plink_short}")
-                    creado = True
-                else:
-                    time.sleep(15)
-            except Exception:
-                time.sleep(15)
+        # --- CREACIÓN (un solo intento; WC_RETRY solo reintenta GET/PUT/DELETE) ---
+        try:
+            res = wcapi.post("products", data)
+            if res.status_code in [200, 201]:
+                p_res = res.json()
+                new_id = p_res["id"]
+                plink_raw = p_res.get("permalink", "")
+                plink_short = acortar_url(plink_raw) if plink_raw else ""
+                if plink_short:
+                    wcapi.put(f"products/{new_id}", {"meta_data": [{"key": "url_post_acortada", "value": plink_short}]})
+                summary_creados.append({"nombre": nombre, "id": new_id})
+
+                print(f"✅ CREADO -> {nombre} (ID: {new_id})")
+                print(f"14b) URL Post Acortada (WP): {plink_short}")
+            else:
+                print(f"❌ ERROR WP ({res.status_code}) creando {nombre}")
+        except Exception as e:
+            print(f"❌ ERROR creando {nombre}: {e}")
 
         await asyncio.sleep(15)
 
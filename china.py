@@ -1,15 +1,24 @@
 import requests
 from bs4 import BeautifulSoup
+import soupsieve as sv
 from woocommerce import API
 import os
+import json
 import time
 import re
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from urllib.parse import urlparse, parse_qs, unquote, quote
+from urllib.parse import urlparse, unquote, unquote_plus, quote
 from collections import defaultdict
 
+# orjson (C) si está instalado; si no, json de la stdlib con la misma interfaz
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 # --- CONFIGURACIÓN WORDPRESS ---
 wcapi = API(
     url=os.environ.get("WP_URL", ""),
@@ -19,6 +28,10 @@ wcapi = API(
     timeout=60
 )
 
+# Sesión HTTP compartida: keep-alive entre peticiones al mismo host
+# (is.gd, fichas, imágenes) en lugar de un handshake TCP+TLS por llamada.
+http_session = requests.Session()
+
 # URL origen oculta en secret
 URL_ORIGEN = os.environ.get("SOURCE_URL_CHINABAY", "")
 
@@ -41,6 +54,13 @@ ID_AFILIADO_ELCORTEINGLES = os.environ.get("AFF_ELCORTEINGLES", "")
 TIENDAS_ESPANA = ["pccomponentes", "aliexpress plaza", "aliexpress", "mediamarkt", "amazon", "fnac", "phone house", "powerplanet"]
 TIENDAS_CHINA = ["gshopper", "dhgate", "banggood"]
 
+# Búsquedas de una sola pasada (sin copiar el HTML entero con .lower())
+RE_EU_WAREHOUSE = re.compile(r"eu warehouse", re.IGNORECASE)
+RE_EU_WAREHOUSE_BYTES = re.compile(rb"eu warehouse", re.IGNORECASE)
+RE_PALABRAS_TIENDA = re.compile(
+    r"store|shop|oficial|tradingshenzhen|aliexpress|amazon|miravia|eleczone|mediamarkt|dhgate"
+)
+
 def _detectar_eu_warehouse_tradingshenzhen(candidate_urls):
     """Devuelve True si detecta 'EU Warehouse' para Tradingshenzhen; False si no; None si no pudo verificar."""
     if not candidate_urls:
@@ -52,22 +72,31 @@ def _detectar_eu_warehouse_tradingshenzhen(candidate_urls):
         try:
             # 1) Si es página interna de Chinabay, buscamos el texto del botón que apunta a Tradingshenzhen
             if "chinabay.es" in u and "/wp-" not in u:
-                r = requests.get(u, headers=headers, timeout=15)
+                r = http_session.get(u, headers=headers, timeout=15)
                 soup = BeautifulSoup(r.text, 'lxml')
                 for a in soup.select("a.elementor-button-link"):
                     href = a.get("href", "") or ""
                     txt = a.get_text(" ", strip=True)
                     if "tradingshenzhen" in href.lower() or "tradingshenzhen" in txt.lower():
-                        if "eu warehouse" in txt.lower():
+                        if RE_EU_WAREHOUSE.search(txt):
                             return True
                 # Si llegamos aquí, no se encontró el indicador
                 return False
 
             # 2) Si es URL directa de Tradingshenzhen, buscamos el texto en la página (fallback)
             if "tradingshenzhen" in u.lower():
-                r = requests.get(u, headers=headers, timeout=15)
-                if "eu warehouse" in r.text.lower():
-                    return True
+                # Lectura en streaming: se corta en cuanto aparece el indicador
+                # (el solape evita perderlo si cae entre dos trozos)
+                r = http_session.get(u, headers=headers, timeout=15, stream=True)
+                try:
+                    cola = b""
+                    for trozo in r.iter_content(65536):
+                        bloque = cola + trozo
+                        if RE_EU_WAREHOUSE_BYTES.search(bloque):
+                            return True
+                        cola = bloque[-16:]
+                finally:
+                    r.close()
                 return False
         except Exception:
             continue
@@ -101,6 +130,11 @@ def calcular_enviado_desde(fuente, texto_item="", candidate_urls=None):
     return enviado_desde, enviado_desde_tg
 
 # --- FUNCIONES AUXILIARES ---
+# Sufijos de modelo en una sola pasada (antes, un re.sub por sufijo)
+SUFIJOS_MODELO = {"gt": "GT", "fe": "FE", "se": "SE", "pro+": "Pro+", "ultra": "Ultra"}
+RE_SUFIJOS_MODELO = re.compile(r'\b(?:gt|fe|se|ultra)\b|\bpro\+\b', re.IGNORECASE)
+RE_MEMORIA_UNIDAD = re.compile(r'(\d+)\s*([gt]b)')
+
 def normalize_text(text):
     if not text:
         return ""
@@ -110,11 +144,7 @@ def normalize_text(text):
     capitalized_words = [w.capitalize() for w in words]
     text = " ".join(capitalized_words)
     text = re.sub(r'(\d)([a-z])', lambda m: m.group(1) + m.group(2).upper(), text)
-    text = re.sub(r'\bgt\b', 'GT', text, flags=re.IGNORECASE)
-    text = re.sub(r'\bfe\b', 'FE', text, flags=re.IGNORECASE)
-    text = re.sub(r'\bse\b', 'SE', text, flags=re.IGNORECASE)
-    text = re.sub(r'\bpro\+\b', 'Pro+', text, flags=re.IGNORECASE)
-    text = re.sub(r'\bultra\b', 'Ultra', text, flags=re.IGNORECASE)
+    text = RE_SUFIJOS_MODELO.sub(lambda m: SUFIJOS_MODELO[m.group(0).lower()], text)
     text = text.replace("Gb", "GB").replace("Tb", "TB").replace("Cn", "CN")
     return text.strip()
 
@@ -146,7 +176,8 @@ def resolver_redireccion_http(url_corta):
         return ""
     try:
         headers = {'User-Agent': 'Mozilla/5.0'}
-        r = requests.get(url_corta, allow_redirects=True, headers=headers, timeout=20, stream=True)
+        r = http_session.get(url_corta, allow_redirects=True, headers=headers, timeout=20, stream=True)
+        r.close()  # solo interesa la URL final; libera la conexión al pool sin leer el cuerpo
         return r.url
     except Exception:
         return url_corta
@@ -172,13 +203,12 @@ def procesar_afiliados_inteligente(url):
             url_base = url.split('?')[0]
         return f"{url_base}{ID_AFILIADO_MEDIAMARKT}"
     if 'tradetracker.net' in url:
-        try:
-            parsed = urlparse(url)
-            qs = parse_qs(parsed.query)
-            if 'u' in qs:
-                url = unquote(qs['u'][0])
-        except:
-            pass
+        # Solo interesa el parámetro 'u': búsqueda directa en la query sin construir parse_qs
+        query = url.partition("?")[2].partition("#")[0]
+        for part in query.split("&"):
+            if part.startswith("u=") and len(part) > 2:
+                url = unquote(unquote_plus(part[2:]))
+                break
     if 'tradingshenzhen.com' in url:
         return url.split("?")[0] + ID_AFILIADO_TRADINGSENZHEN
     if 'aliexpress' in url_lower:
@@ -198,7 +228,7 @@ def analizar_pagina_interna(url_interna):
     url_final = url_interna
     try:
         headers = {'User-Agent': 'Mozilla/5.0'}
-        r = requests.get(url_interna, headers=headers, timeout=15)
+        r = http_session.get(url_interna, headers=headers, timeout=15)
         soup = BeautifulSoup(r.text, 'lxml')
         candidato = ""
         botones = soup.select("a.elementor-button-link")
@@ -226,7 +256,7 @@ def analizar_pagina_interna(url_interna):
         for elem in elementos_texto:
             txt = elem.get_text(strip=True)
             txt_lower = txt.lower()
-            if any(k in txt_lower for k in ["store", "shop", "oficial", "tradingshenzhen", "aliexpress", "amazon", "miravia", "eleczone", "mediamarkt", "dhgate"]):
+            if RE_PALABRAS_TIENDA.search(txt_lower):
                 if len(txt) < 60 and "envio" not in txt_lower:
                     if "🇨🇳" in txt or "cn" in txt_lower.split():
                         version_detectada = "CN"
@@ -247,7 +277,7 @@ def acortar_url(url):
         return ""
     try:
         api_url = f"https://is.gd/create.php?format=simple&url={quote(url)}"
-        r = requests.get(api_url, timeout=10)
+        r = http_session.get(api_url, timeout=10)
         if r.status_code == 200 and "http" in r.text:
             return r.text.strip()
     except:
@@ -264,13 +294,13 @@ def generar_url_puente(url_imagen_original):
         return ""
     try:
         headers = {'User-Agent': 'Mozilla/5.0', 'Referer': URL_ORIGEN or ''}
-        r = requests.get(url_imagen_original, headers=headers, timeout=15)
+        r = http_session.get(url_imagen_original, headers=headers, timeout=15)
         if r.status_code != 200:
             return ""
         catbox_url = "https://catbox.moe/user/api.php"
         files = {'fileToUpload': ('image.jpg', r.content, 'image/jpeg')}
         data = {'reqtype': 'fileupload', 'userhash': ''}
-        post = requests.post(catbox_url, files=files, data=data, timeout=30)
+        post = http_session.post(catbox_url, files=files, data=data, timeout=30)
         if post.status_code == 200 and "catbox.moe" in post.text:
             return post.text.strip()
     except:
@@ -281,8 +311,7 @@ def normalize_memoria(text):
     if not text:
         return ""
     text = str(text).lower().strip()
-    text = re.sub(r'(\d+)\s*gb', r'\1 GB', text)
-    text = re.sub(r'(\d+)\s*tb', r'\1 TB', text)
+    text = RE_MEMORIA_UNIDAD.sub(r'\1 \2', text)
     return text.upper()
 
 def limpiar_precio(texto):
@@ -369,7 +398,7 @@ def cargar_todas_las_categorias():
     page = 1
     while True:
         try:
-            res = wcapi.get("products/categories", params={"per_page": 100, "page": page}).json()
+            res = json_loads(wcapi.get("products/categories", params={"per_page": 100, "page": page}).content)
         except:
             break
         if not res:
@@ -468,6 +497,16 @@ def gestionar_jerarquia_e_imagen(marca, nombre_completo_movil, url_imagen_scrap)
     return id_padre, id_hijo, imagen_final_url
 
 # --- FASE 1: SCRAPING ---
+# Selectores de tarjeta precompilados (soupsieve viene con bs4): se aplican a
+# cada tarjeta del listado sin volver a parsear el CSS en cada select_one.
+SEL_ITEMS = sv.compile("div.e-loop-item")
+SEL_ITEM_MARCA = sv.compile("h2.elementor-heading-title")
+SEL_ITEM_H3 = sv.compile("h3.elementor-heading-title")
+SEL_ITEM_PRECIO_REGULAR = sv.compile("#precio_of h4")
+SEL_ITEM_BOTON = sv.compile("a.elementor-button-link")
+SEL_ITEM_IMG = sv.compile("div.elementor-widget-image img")
+SEL_ITEM_CUPON = sv.compile("[data-coupon]")
+
 def obtener_productos_remotos():
     print(f"--- FASE 1: Escaneando {URL_ORIGEN} ---", flush=True)
     if not URL_ORIGEN:
@@ -476,17 +515,17 @@ def obtener_productos_remotos():
     headers = {'User-Agent': 'Mozilla/5.0'}
     productos_validos = []
     try:
-        r = requests.get(URL_ORIGEN, headers=headers, timeout=20)
+        r = http_session.get(URL_ORIGEN, headers=headers, timeout=20)
         soup = BeautifulSoup(r.text, 'lxml')
-        items = soup.select("div.e-loop-item")
+        items = SEL_ITEMS.select(soup)
         print(f"🔍 Encontradas {len(items)} tarjetas. Procesando...", flush=True)
         for item in items:
             try:
-                h2 = item.select_one("h2.elementor-heading-title")
+                h2 = SEL_ITEM_MARCA.select_one(item)
                 if not h2:
                     continue
                 raw_brand = h2.get_text(strip=True)
-                h3s = item.select("h3.elementor-heading-title")
+                h3s = SEL_ITEM_H3.select(item)
                 memoria_raw = ""
                 precio_actual = 0.0
                 raw_model = ""
@@ -501,7 +540,7 @@ def obtener_productos_remotos():
                         raw_model = txt
                 if precio_actual <= 0 or not memoria_raw:
                     continue
-                h4_precio = item.select_one("#precio_of h4")
+                h4_precio = SEL_ITEM_PRECIO_REGULAR.select_one(item)
                 precio_regular = limpiar_precio(h4_precio.get_text(strip=True)) if h4_precio else precio_actual
 
                 memoria_clean = re.sub(r'\s+', ' ', memoria_raw).strip()
@@ -522,7 +561,7 @@ def obtener_productos_remotos():
                 if "pad" in nombre_movil_final.lower():
                     continue
 
-                btn = item.select_one("a.elementor-button-link")
+                btn = SEL_ITEM_BOTON.select_one(item)
                 enlace_de_compra_importado = btn['href'] if btn else ""
 
                 url_oferta_sin_acortar = enlace_de_compra_importado
@@ -533,7 +572,8 @@ def obtener_productos_remotos():
                 else:
                     url_oferta_sin_acortar = resolver_redireccion_http(enlace_de_compra_importado)
 
-                url_final, fuente_real, version_real = obtener_datos_finales(enlace_de_compra_importado, item.get_text())
+                texto_item = item.get_text()
+                url_final, fuente_real, version_real = obtener_datos_finales(enlace_de_compra_importado, texto_item)
                 if fuente_real == "Amazon":
                     url_importada_sin_afiliado = url_oferta_sin_acortar.split('#')[0].split('?')[0]
                 elif fuente_real.strip().lower() in ["phone house", "phonehouse"]:
@@ -558,14 +598,15 @@ def obtener_productos_remotos():
 
                 url_oferta = acortar_url(url_sin_acortar_con_mi_afiliado)
 
-                img = item.select_one("div.elementor-widget-image img")
+                img = SEL_ITEM_IMG.select_one(item)
                 img_src_original = img['src'] if img else ""
                 img_src = img_src_original
-                cupon = item.select_one("[data-coupon]")['data-coupon'] if item.select_one("[data-coupon]") else "OFERTA PROMO"
+                cupon_tag = SEL_ITEM_CUPON.select_one(item)
+                cupon = cupon_tag['data-coupon'] if cupon_tag else "OFERTA PROMO"
 
                 enviado_desde, enviado_desde_tg = calcular_enviado_desde(
                     fuente_real,
-                    texto_item=item.get_text(),
+                    texto_item=texto_item,
                     candidate_urls=[enlace_de_compra_importado, url_oferta_sin_acortar, url_importada_sin_afiliado]
                 )
 
@@ -633,7 +674,7 @@ def sincronizar_productos(remotos):
     page = 1
     while True:
         try:
-            res = wcapi.get("products", params={"per_page": 100, "page": page, "status": "publish"}).json()
+            res = json_loads(wcapi.get("products", params={"per_page": 100, "page": page, "status": "publish"}).content)
             if not res or "message" in res: break
             for p in res:
                 meta = {m['key']: m['value'] for m in p.get('meta_data', [])}
@@ -1,14 +1,27 @@
 # scraper_compras.py
 import os
-import time
+import atexit
+import functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
 import urllib.parse
 import json
 import re
 import base64
 from datetime import datetime
-from bs4 import BeautifulSoup
+import time
+from selectolax.parser import HTMLParser
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from woocommerce import API
+import woocommerce.api as woocommerce_api
+
+# orjson (C) si está instalado; si no, json de la stdlib con la misma interfaz
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
 # --- CONFIGURACIÓN WORDPRESS desde variables de entorno ---
 wcapi = API(
@@ -19,6 +32,41 @@ wcapi = API(
     timeout=60
 )
 
+# Sesión HTTP para WooCommerce: keep-alive + reintentos con backoff exponencial
+# (429/5xx) en lugar de esperas fijas entre intentos.
+# POST queda fuera a propósito: un alta (products o products/batch) que WooCommerce
+# ya ha aplicado (timeout de lectura o 502/504 tras el commit) se reenviaría y
+# crearía duplicados. Solo se reintentan métodos idempotentes.
+WC_RETRY = Retry(
+    total=5,
+    backoff_factor=1.0,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=frozenset(["GET", "PUT", "DELETE"]),
+    raise_on_status=False,
+)
+wc_session = requests.Session()
+wc_session.mount("https://", HTTPAdapter(max_retries=WC_RETRY))
+wc_session.mount("http://", HTTPAdapter(max_retries=WC_RETRY))
+# woocommerce.API hace cada llamada con requests.request(): la redirigimos a la sesión.
+woocommerce_api.request = wc_session.request
+
+# Altas de producto concurrentes contra WordPress
+MAX_WORKERS_WC = 8
+# Límite de operaciones por petición de WooCommerce en los endpoints /batch
+WC_BATCH_MAX = 100
+
+# Sesión HTTP compartida para el scraping: conexiones keep-alive reutilizadas entre
+# páginas del mismo host y reintento ante 429/503.
+SCRAPER_RETRY = Retry(total=3, backoff_factor=1, status_forcelist=[429, 503])
+scraper_session = requests.Session()
+scraper_session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=SCRAPER_RETRY))
+scraper_session.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=SCRAPER_RETRY))
+
+# Expansión/acortado de enlaces concurrente por producto
+MAX_WORKERS_URLS = 16
+# Enlaces de oferta de hasta esta longitud se publican tal cual, sin pasar por is.gd
+LONGITUD_MAX_SIN_ACORTAR = 120
+
 # --- ORIGEN Y AFILIADOS desde variables de entorno ---
 # No hay literales en el código: todo se lee desde variables de entorno o secrets.
 
@@ -67,6 +115,9 @@ def _norm_import_id(v: str) -> str:
 
 
 ID_IMPORTACION_NORM = _norm_import_id(ID_IMPORTACION)
+# Formas exactas en que se guarda el meta (con y sin / final)
+IDS_IMPORTACION = frozenset((ID_IMPORTACION_NORM, ID_IMPORTACION_NORM + "/"))
+META_IMPORTADO_DE = {"key": "importado_de", "value": ID_IMPORTACION_NORM}  # compartido por todas las altas
 ID_AFILIADO_ALIEXPRESS = os.environ.get("AFF_ALIEXPRESS", "")
 ID_AFILIADO_MEDIAMARKT = os.environ.get("AFF_MEDIAMARKT", "")
 ID_AFILIADO_AMAZON = os.environ.get("AFF_AMAZON", "")
@@ -80,51 +131,154 @@ summary_eliminados = []
 summary_ignorados = []
 summary_actualizados = []
 
+# Imagen servida por el proxy de Next.js (/_next/image?url=...&w=...)
+RE_IMG_URL = re.compile(r"[?&]url=([^&#]+)")
+
+# Patrones de _expandir_url_red compilados una sola vez (se evalúan por cada salto)
+RE_TD_PDT = re.compile(r"a\((\d+)\).*?p\((\d+)\).*?url\(([^)]+)\)")
+RE_AWIN_EMBED = re.compile(r'https?://www\.awin1\.com/(?:cread|pclick)\.php\?[^"\']+', re.I)
+RE_CANONICAL = re.compile(r'rel=["\']canonical["\'][^>]*href=["\']([^"\']+)["\']', re.I)
+RE_OG_URL = re.compile(r'property=["\']og:url["\'][^>]*content=["\']([^"\']+)["\']', re.I)
+RE_META_REFRESH = re.compile(r'http-equiv=["\']refresh["\'][^>]*content=["\'][^"\']*url=([^"\']+)["\']', re.I)
+RE_JS_REDIRECTS = (
+    re.compile(r'(?:window\.location|location\.href|document\.location)\s*=\s*["\']([^"\']+)["\']', re.I),
+    re.compile(r'location\.replace\(\s*["\']([^"\']+)["\']\s*\)', re.I),
+)
+RE_ATOB = re.compile(r'atob\(\s*["\']([^"\']+)["\']\s*\)', re.I)
+RE_DECODE_URI = re.compile(r'decodeURIComponent\(\s*["\']([^"\']+)["\']\s*\)', re.I)
+RE_URL_HTTP = re.compile(r'https?://[^\s"\']+', re.I)
+RE_URL_ESCAPADA = re.compile(r'https?:\\/\\/[^\s"\']+', re.I)
+RE_URL_RELATIVA = re.compile(r'//[^\s"\']+', re.I)
+
+# "1.299,99 €" -> "1299.99" en una sola pasada
+PRECIO_TRANS = str.maketrans({"€": None, ".": None, ",": "."})
+
 def limpiar_precio(texto):
     if not texto:
         return "0"
-    return texto.replace("€", "").replace(".", "").replace(",", ".").strip()
-
-def extraer_items_next_data(html: str):
+    return texto.translate(PRECIO_TRANS).strip()
+
+BANDERAS_ENVIADO_DESDE = {
+    "España": "🇪🇸 España",
+    "Europa": "🇪🇺 Europa",
+    "China": "🇨🇳 China",
+}
+
+def bandera_enviado_desde(enviado_desde):
+    """Texto con bandera para Telegram a partir de 'enviado_desde' ("" si no aplica)."""
+    return BANDERAS_ENVIADO_DESDE.get(enviado_desde, "")
+
+FUENTES_PRINCIPALES = frozenset(("MediaMarkt", "AliExpress Plaza", "PcComponentes", "Fnac", "Amazon", "Phone House"))
+TIENDAS_ESPANA = frozenset((
+    "pccomponentes",
+    "aliexpress plaza",
+    "mediamarkt",
+    "amazon",
+    "fnac",
+    "phone house",
+    "powerplanet",
+))
+
+# Funciones puras de (fuente, flag): el mismo par se repite en decenas de items
+@functools.lru_cache(maxsize=1024)
+def detectar_enviado_desde(fuente, desde_espana=False):
+    return "España" if desde_espana or (fuente or "").lower() in TIENDAS_ESPANA else ""
+
+@functools.lru_cache(maxsize=1024)
+def detectar_version(fuente, es_global=False):
+    if fuente not in FUENTES_PRINCIPALES:
+        return "Global Version"
+    return "Versión Global" if es_global else "N/A"
+
+# Fuentes cuya URL de producto se usa sin query string
+FUENTES_SIN_QUERY = frozenset(("MediaMarkt", "PcComponentes", "Amazon", "Phone House"))
+
+def url_sin_afiliado(url_exp, fuente):
+    """URL expandida sin parámetros de afiliado/tracking, según la fuente."""
+    url_exp = url_exp or ""
+    fuente_norm = (fuente or "").strip().lower()
+    # Joom siempre sin query
+    if fuente_norm == "joom" or "joom.com/" in url_exp:
+        return url_exp.split("?")[0]
+    if fuente in FUENTES_SIN_QUERY or fuente_norm == "xiaomi store":
+        return url_exp.split("?")[0]
+    if fuente == "AliExpress Plaza":
+        return url_exp.split(".html")[0] + ".html" if ".html" in url_exp else url_exp.split("?")[0]
+    if fuente == "Fnac":
+        # Mantener ?oref=...& y eliminar desde sv_ en adelante (incluyendo sv_)
+        if "&sv_" in url_exp:
+            return url_exp.split("&sv_")[0] + "&"
+        if "?sv_" in url_exp:
+            return url_exp.split("?sv_")[0]
+        return url_exp.split("?")[0]
+    return url_exp
+
+# fuente -> (id de afiliado, si el id "?x=y" debe encadenarse a una query existente)
+AFILIADOS = {
+    "MediaMarkt": (ID_AFILIADO_MEDIAMARKT, False),
+    "AliExpress Plaza": (ID_AFILIADO_ALIEXPRESS, False),
+    "Fnac": (ID_AFILIADO_FNAC, True),
+    "Amazon": (ID_AFILIADO_AMAZON, False),
+    "Xiaomi Store": (ID_AFILIADO_XIAOMI_STORE, False),
+    "El Corte Inglés": (ID_AFILIADO_ELCORTEINGLES, True),
+}
+
+def url_con_afiliado(url, fuente):
+    """Añade nuestro id de afiliado (variables de entorno AFF_*) a la URL limpia."""
+    aff, encadenar = AFILIADOS.get(fuente, ("", False))
+    if not aff:
+        return url
+    if encadenar and aff.startswith("?"):
+        if url.endswith("&"):
+            return f"{url}{aff[1:]}"
+        if "?" in url:
+            return f"{url}&{aff[1:]}"
+    return f"{url}{aff}"
+
+NEXT_CLAVES_NOMBRE = frozenset(("name", "title"))
+NEXT_CLAVES_URL = frozenset(("url", "href", "link"))
+NEXT_CLAVES_PRECIO = frozenset(("price", "precio", "saleprice", "currentprice", "precio_actual"))
+
+def extraer_items_next_data(tree):
     """Fallback para páginas Next.js: extrae items desde <script id="__NEXT_DATA__">.
+    Recibe el árbol ya parseado del listado (no se vuelve a parsear la página).
     Devuelve una lista de dicts con claves similares a las usadas por el parser HTML.
     """
     try:
-        soup = BeautifulSoup(html, "lxml")
-        script = soup.find("script", id="__NEXT_DATA__")
-        if not script or not script.string:
+        script = tree.css_first("script#__NEXT_DATA__")
+        contenido = script.text() if script else ""
+        if not contenido:
             return []
-        data = json.loads(script.string)
+        data = json_loads(contenido)
 
         candidatos = []
 
-        def walk(x):
+        # Recorrido iterativo (pila explícita): el JSON de Next.js puede ser muy
+        # profundo; los hijos se apilan invertidos para conservar el orden original.
+        pila = [data]
+        while pila:
+            x = pila.pop()
             if isinstance(x, dict):
-                keys = {str(k).lower() for k in x.keys()}
-                has_name = ("name" in keys) or ("title" in keys)
-                has_url = ("url" in keys) or ("href" in keys) or ("link" in keys)
-                has_price = any(k in keys for k in ("price","precio","saleprice","currentprice","precio_actual"))
-                if has_name and has_url and has_price:
+                keys = {str(k).lower() for k in x}
+                if not keys.isdisjoint(NEXT_CLAVES_NOMBRE) and not keys.isdisjoint(NEXT_CLAVES_URL) \
+                        and not keys.isdisjoint(NEXT_CLAVES_PRECIO):
                     candidatos.append(x)
-                for v in x.values():
-                    walk(v)
+                pila.extend(reversed(list(x.values())))
             elif isinstance(x, list):
-                for v in x:
-                    walk(v)
-
-        walk(data)
+                pila.extend(reversed(x))
 
         items = []
         for c in candidatos:
-            nombre = c.get("name") or c.get("title") or ""
-            url_imp = c.get("url") or c.get("href") or c.get("link") or ""
-            fuente = c.get("store") or c.get("merchant") or c.get("fuente") or c.get("shop") or ""
-            img = c.get("image") or c.get("imageUrl") or c.get("img") or ""
-            p_act = c.get("salePrice") or c.get("currentPrice") or c.get("price") or c.get("precio_actual") or c.get("precio") or ""
-            p_reg = c.get("oldPrice") or c.get("regularPrice") or c.get("precio_original") or ""
-            ram = c.get("ram") or c.get("memoria") or ""
-            rom = c.get("rom") or c.get("storage") or c.get("capacidad") or ""
-            specs = c.get("specs") or c.get("description") or ""
+            get = c.get  # alias local: ~25 búsquedas por candidato
+            nombre = get("name") or get("title") or ""
+            url_imp = get("url") or get("href") or get("link") or ""
+            fuente = get("store") or get("merchant") or get("fuente") or get("shop") or ""
+            img = get("image") or get("imageUrl") or get("img") or ""
+            p_act = get("salePrice") or get("currentPrice") or get("price") or get("precio_actual") or get("precio") or ""
+            p_reg = get("oldPrice") or get("regularPrice") or get("precio_original") or ""
+            ram = get("ram") or get("memoria") or ""
+            rom = get("rom") or get("storage") or get("capacidad") or ""
+            specs = get("specs") or get("description") or ""
 
             items.append({
                 "raw_nombre": str(nombre),
@@ -141,14 +295,76 @@ def extraer_items_next_data(html: str):
     except Exception:
         return []
 
+# --- CACHÉ PERSISTENTE DE URLS (is.gd + expansión) ---
+# Los enlaces acortados y los destinos de afiliado se repiten entre ejecuciones:
+# se guardan en disco y se vuelcan al salir. Los códigos de is.gd son permanentes
+# ({url: corta}); las expansiones caducan a los CACHE_EXPANSION_TTL segundos
+# ({url: [destino, timestamp]}) por si el afiliado cambia de destino.
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "compras")
+CACHE_ACORTADOR = os.path.join(CACHE_DIR, "shortener.json")
+CACHE_EXPANSION = os.path.join(CACHE_DIR, "expander.json")
+CACHE_EXPANSION_TTL = 7 * 86400
+# Listados: {url: {"etag", "last_modified", "html"}} para GET condicional (304)
+CACHE_LISTADOS = os.path.join(CACHE_DIR, "listados.json")
+
+
+def _cargar_cache_json(ruta):
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def _guardar_cache_json(ruta, data):
+    if not data:
+        return
+    try:
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        tmp = ruta + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, ruta)
+    except Exception:
+        pass
+
+
+cache_acortador = _cargar_cache_json(CACHE_ACORTADOR)
+cache_expansion = _cargar_cache_json(CACHE_EXPANSION)
+atexit.register(_guardar_cache_json, CACHE_ACORTADOR, cache_acortador)
+atexit.register(_guardar_cache_json, CACHE_EXPANSION, cache_expansion)
+cache_listados = _cargar_cache_json(CACHE_LISTADOS)
+atexit.register(_guardar_cache_json, CACHE_LISTADOS, cache_listados)
+
+
+@functools.lru_cache(maxsize=4096)
 def acortar_url(url):
+    if url in cache_acortador:
+        return cache_acortador[url]
     try:
         url_encoded = urllib.parse.quote(url, safe="")
-        r = requests.get(f"https://is.gd/create.php?format=simple&url={url_encoded}", timeout=8)
-        return r.text.strip() if r.status_code == 200 else url
+        r = scraper_session.get(f"https://is.gd/create.php?format=simple&url={url_encoded}", timeout=(5, 8))
+        if r.status_code == 200 and r.text.strip().startswith("http"):
+            cache_acortador[url] = r.text.strip()
+            return cache_acortador[url]
+        return url
     except:
         return url
 
+# Tiendas cuyo enlace ya es el destino final (s.click.aliexpress.com y similares
+# sí son redirectores y se siguen expandiendo).
+HOSTS_TIENDA_DIRECTA = (
+    "mediamarkt.es",
+    "aliexpress.com",
+    "amazon.",
+    "fnac.es",
+    "pccomponentes.com",
+    "phonehouse.es",
+)
+
+
+@functools.lru_cache(maxsize=2048)
 def expandir_url(url: str) -> str:
     """
     Expande enlaces (redirects + acortadores + wrappers), con especial cuidado en:
@@ -159,7 +375,30 @@ def expandir_url(url: str) -> str:
     """
     if not url:
         return ""
+    cacheada = cache_expansion.get(url)
+    if isinstance(cacheada, list) and len(cacheada) == 2 and time.time() - cacheada[1] < CACHE_EXPANSION_TTL:
+        return cacheada[0]
+    host = (urllib.parse.urlparse(url).netloc or "").lower()
+    if any(h in host for h in HOSTS_TIENDA_DIRECTA) and "click." not in host:
+        # Ya apunta a la tienda: no hay redirección que seguir.
+        return url
+    final = _expandir_url_red(url)
+    if final and final != url:
+        cache_expansion[url] = [final, int(time.time())]
+    return final
+
+
+def _qs_get(query: str, key: str):
+    """Primer valor no vacío de 'key' en la query (como parse_qs) sin construir el dict completo."""
+    needle = key + "="
+    for part in query.split("&"):
+        if part.startswith(needle) and len(part) > len(needle):
+            return urllib.parse.unquote_plus(part[len(needle):])
+    return None
 
+
+def _expandir_url_red(url: str) -> str:
+    """Resolución en red de expandir_url (sin caché)."""
     headers = {
         "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0 Safari/537.36",
         "Accept-Language": "es-ES,es;q=0.9",
@@ -198,10 +437,10 @@ def expandir_url(url: str) -> str:
             host = (pu.netloc or "").lower()
             if "awin1.com" not in host:
                 return ""
-            qs = urllib.parse.parse_qs(pu.query)
             for k in ("ued", "url", "desturl", "destination"):
-                if k in qs and qs[k]:
-                    return urllib.parse.unquote(qs[k][0])
+                v = _qs_get(pu.query, k)
+                if v:
+                    return urllib.parse.unquote(v)
         except Exception:
             pass
         return ""
@@ -211,7 +450,7 @@ def expandir_url(url: str) -> str:
         try:
             if "pdt.tradedoubler.com/click" not in u:
                 return u
-            m = re.search(r"a\((\d+)\).*?p\((\d+)\).*?url\(([^)]+)\)", u)
+            m = RE_TD_PDT.search(u)
             if not m:
                 return u
             dest = urllib.parse.unquote(m.group(3))
@@ -223,18 +462,21 @@ def expandir_url(url: str) -> str:
         try:
             p = urllib.parse.urlparse(u)
             host = (p.netloc or "").lower()
-            qs = urllib.parse.parse_qs(p.query)
-            if "tradedoubler" in host and "url" in qs and qs["url"]:
-                return urllib.parse.unquote(qs["url"][0])
-            if "tradetracker" in host and "u" in qs and qs["u"]:
-                return urllib.parse.unquote(qs["u"][0])
+            if "tradedoubler" in host:
+                v = _qs_get(p.query, "url")
+            elif "tradetracker" in host:
+                v = _qs_get(p.query, "u")
+            else:
+                v = None
+            if v:
+                return urllib.parse.unquote(v)
         except Exception:
             pass
         return u
 
     def _extract_from_html(base_url: str, html: str) -> str:
         # Awin embed
-        m = re.search(r'https?://www\.awin1\.com/(?:cread|pclick)\.php\?[^"\']+', html, re.I)
+        m = RE_AWIN_EMBED.search(html)
         if m:
             aw = m.group(0).strip()
             dest = _extract_awin_destination(aw)
@@ -242,65 +484,62 @@ def expandir_url(url: str) -> str:
                 return dest
 
         # canonical
-        m = re.search(r'rel=["\']canonical["\'][^>]*href=["\']([^"\']+)["\']', html, re.I)
+        m = RE_CANONICAL.search(html)
         if m:
             return urllib.parse.urljoin(base_url, m.group(1).strip())
 
         # og:url
-        m = re.search(r'property=["\']og:url["\'][^>]*content=["\']([^"\']+)["\']', html, re.I)
+        m = RE_OG_URL.search(html)
         if m:
             return urllib.parse.urljoin(base_url, m.group(1).strip())
 
         # meta refresh
-        m = re.search(r'http-equiv=["\']refresh["\'][^>]*content=["\'][^"\']*url=([^"\']+)["\']', html, re.I)
+        m = RE_META_REFRESH.search(html)
         if m:
             return urllib.parse.urljoin(base_url, m.group(1).strip())
 
         # JS redirects
-        for pat in [
-            r'(?:window\.location|location\.href|document\.location)\s*=\s*["\']([^"\']+)["\']',
-            r'location\.replace\(\s*["\']([^"\']+)["\']\s*\)',
-        ]:
-            m = re.search(pat, html, re.I)
+        for pat in RE_JS_REDIRECTS:
+            m = pat.search(html)
             if m:
                 return urllib.parse.urljoin(base_url, m.group(1).strip())
 
         # atob('...') base64
-        m = re.search(r'atob\(\s*["\']([^"\']+)["\']\s*\)', html, re.I)
+        m = RE_ATOB.search(html)
         if m:
             try:
                 b64 = m.group(1).strip()
                 pad = '=' * (-len(b64) % 4)
                 decoded = base64.b64decode((b64 + pad).encode('utf-8', 'ignore')).decode('utf-8', 'ignore')
-                mm = re.search(r'https?://[^\s"\']+', decoded, re.I)
+                mm = RE_URL_HTTP.search(decoded)
                 if mm:
                     return mm.group(0).strip()
             except Exception:
                 pass
 
         # decodeURIComponent('...')
-        m = re.search(r'decodeURIComponent\(\s*["\']([^"\']+)["\']\s*\)', html, re.I)
+        m = RE_DECODE_URI.search(html)
         if m:
             try:
                 dec = urllib.parse.unquote(m.group(1).strip())
-                mm = re.search(r'https?://[^\s"\']+', dec, re.I)
+                mm = RE_URL_HTTP.search(dec)
                 if mm:
                     return mm.group(0).strip()
             except Exception:
                 pass
 
         # URLs escapadas (https:\/\/...)
-        m = re.search(r'https?:\\/\\/[^\s"\']+', html, re.I)
+        m = RE_URL_ESCAPADA.search(html)
         if m:
             return m.group(0).replace('\\/','/').replace('\\','').strip()
 
         # Protocolo relativo //...
-        m = re.search(r'//[^\s"\']+', html, re.I)
+        m = RE_URL_RELATIVA.search(html)
         if m:
             return "https:" + m.group(0).strip()
 
         # fallback URL razonable
-        for cand in re.findall(r'https?://[^\s"\']+', html):
+        for cand in RE_URL_HTTP.findall(html):
             c = cand.strip()
             if _looks_like_resource(c):
                 continue
@@ -311,7 +550,7 @@ def expandir_url(url: str) -> str:
 
         return base_url
 
-    s = requests.Session()
+    s = scraper_session
     current = _unwrap_tradedoubler_pdt(url)
 
     for _ in range(10):
@@ -321,7 +560,7 @@ def expandir_url(url: str) -> str:
         # Preflight sin redirects (Location)
         if h_cur in SHORTENER_HOSTS:
             try:
-                r0 = s.get(current, headers=headers, allow_redirects=False, timeout=20)
+                r0 = s.get(current, headers=headers, allow_redirects=False, timeout=(5, 20))
                 loc = r0.headers.get("Location") or r0.headers.get("location")
                 if loc:
                     current = urllib.parse.urljoin(current, loc)
@@ -333,11 +572,26 @@ def expandir_url(url: str) -> str:
                 pass
 
         try:
-            r = s.get(current, headers=headers, allow_redirects=True, timeout=25)
+            # stream=True: solo se leen cabeceras; el cuerpo se descarga únicamente cuando
+            # hay que buscar una redirección HTML/JS (acortadores y wrappers que responden 200).
+            r = s.get(current, headers=headers, allow_redirects=True, timeout=(5, 20), stream=True)
         except Exception:
             return current
 
         final_url = getattr(r, "url", "") or current
+        h_final = _host(final_url)
+        content_type = (r.headers.get("Content-Type") or "").lower()
+        necesita_html = (
+            final_url == current and r.status_code == 200
+            and ("text/html" in content_type or "text/plain" in content_type or content_type == "")
+            and (h_final in SHORTENER_HOSTS or any(x in h_final for x in ["tradedoubler", "tradetracker", "awin1.com"]))
+        )
+        try:
+            html = (r.text or "") if necesita_html else ""
+        except Exception:
+            html = ""
+        finally:
+            r.close()
 
         # Awin destino directo
         aw = _extract_awin_destination(final_url)
@@ -349,21 +603,17 @@ def expandir_url(url: str) -> str:
             current = unwrapped
             continue
 
-        h_final = _host(final_url)
-
         if _is_amazon(h_final) or _is_amazon(h_cur):
             return final_url
 
-        content_type = (r.headers.get("Content-Type") or "").lower()
-        if final_url == current and r.status_code == 200 and ("text/html" in content_type or "text/plain" in content_type or content_type == ""):
-            if h_final in SHORTENER_HOSTS or any(x in h_final for x in ["tradedoubler", "tradetracker", "awin1.com"]):
-                extracted = _extract_from_html(final_url, r.text or "")
-                if extracted and extracted != current and not _looks_like_resource(extracted):
-                    aw2 = _extract_awin_destination(extracted)
-                    if aw2 and not _looks_like_resource(aw2):
-                        return aw2
-                    current = extracted
-                    continue
+        if necesita_html:
+            extracted = _extract_from_html(final_url, html)
+            if extracted and extracted != current and not _looks_like_resource(extracted):
+                aw2 = _extract_awin_destination(extracted)
+                if aw2 and not _looks_like_resource(aw2):
+                    return aw2
+                current = extracted
+                continue
 
         return final_url
 
@@ -371,19 +621,59 @@ def expandir_url(url: str) -> str:
 
 
 # --- GESTIÓN DE CATEGORÍAS ---
-def obtener_todas_las_categorias():
-    categorias = []
-    page = 1
-    while True:
+def obtener_paginado_wc(recurso, params=None, estricto=False):
+    """GET paginado contra la API de WooCommerce.
+    La primera respuesta trae X-WP-TotalPages; el resto de páginas se piden en paralelo.
+    Con estricto=True cualquier página fallida (o un total que no cuadra con
+    X-WP-Total) lanza excepción en lugar de devolver una lista incompleta.
+    """
+    params = dict(params or {}, per_page=100)
+    try:
+        res = wcapi.get(recurso, params={**params, "page": 1})
+        primera = json_loads(res.content)
+    except Exception:
+        if estricto:
+            raise
+        return []
+    if not isinstance(primera, list):
+        if estricto:
+            raise RuntimeError(f"Respuesta inesperada de WooCommerce en {recurso} (página 1): {str(primera)[:200]}")
+        return []
+    try:
+        total_paginas = int(res.headers.get("X-WP-TotalPages", 1))
+    except (TypeError, ValueError):
+        total_paginas = 1
+
+    def _pagina(n):
         try:
-            res = wcapi.get("products/categories", params={"per_page": 100, "page": page}).json()
-            if not res or "message" in res or len(res) == 0:
-                break
-            categorias.extend(res)
-            page += 1
-        except:
-            break
-    return categorias
+            datos = json_loads(wcapi.get(recurso, params={**params, "page": n}).content)
+        except Exception:
+            if estricto:
+                raise
+            return []
+        if not isinstance(datos, list):
+            if estricto:
+                raise RuntimeError(f"Respuesta inesperada de WooCommerce en {recurso} (página {n}): {str(datos)[:200]}")
+            return []
+        return datos
+
+    resultados = list(primera)
+    if total_paginas > 1:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS_WC) as executor:
+            for datos in executor.map(_pagina, range(2, total_paginas + 1)):
+                resultados.extend(datos)
+
+    if estricto:
+        try:
+            total = int(res.headers.get("X-WP-Total", len(resultados)))
+        except (TypeError, ValueError):
+            total = len(resultados)
+        if total != len(resultados):
+            raise RuntimeError(f"Listado incompleto de {recurso}: {len(resultados)} de {total}")
+    return resultados
+
+def obtener_todas_las_categorias():
+    return obtener_paginado_wc("products/categories", {"_fields": "id,name,parent,image"})
 
 def resolver_jerarquia(nombre_completo, cache_categorias):
     palabras = nombre_completo.split()
@@ -415,7 +705,68 @@ def resolver_jerarquia(nombre_completo, cache_categorias):
     
     return id_cat_padre, id_cat_hijo, foto_final
 
+def crear_categorias_faltantes(nombres_productos, cache_categorias):
+    """Crea las categorías que necesitará resolver_jerarquia para 'nombres_productos'.
+    Primero los padres (marca) y después los hijos (modelo); cada nivel en paralelo.
+    """
+    def _crear(payload):
+        try:
+            res = wcapi.post("products/categories", payload).json()
+            return res if isinstance(res, dict) and res.get('id') else None
+        except Exception:
+            return None
+
+    def _crear_en_paralelo(payloads):
+        if not payloads:
+            return
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS_WC) as executor:
+            for res in executor.map(_crear, payloads):
+                if res:
+                    cache_categorias.append(res)
+
+    existentes = {(c['name'].lower(), c['parent']) for c in cache_categorias}
+    padres = {}
+    for nombre in nombres_productos:
+        padre = nombre.split()[0]
+        if (padre.lower(), 0) not in existentes:
+            padres.setdefault(padre.lower(), padre)
+    _crear_en_paralelo([{"name": padre} for padre in padres.values()])
+
+    id_padres = {c['name'].lower(): c['id'] for c in cache_categorias if c['parent'] == 0}
+    existentes = {(c['name'].lower(), c['parent']) for c in cache_categorias}
+    hijos = {}
+    for nombre in nombres_productos:
+        id_padre = id_padres.get(nombre.split()[0].lower())
+        if id_padre and (nombre.lower(), id_padre) not in existentes:
+            hijos.setdefault((nombre.lower(), id_padre), {"name": nombre, "parent": id_padre})
+    _crear_en_paralelo(list(hijos.values()))
+
 # --- FASE 1: SCRAPING ---
+def imprimir_detalle_producto(p):
+    # --- LOGS DETALLADOS SOLICITADOS ---
+    # Un único write por producto en lugar de una llamada a print() por campo
+    print("\n".join([
+        f"Detectado {p['nombre']}",
+        f"1) Nombre: {p['nombre']}",
+        f"2) Memoria: {p['ram']}",
+        f"3) Capacidad: {p['rom']}",
+        f"4) Versión: {p['ver']}",
+        f"5) Fuente: {p['fuente']}",
+        f"6) Precio actual: {p['p_act']}",
+        f"7) Precio original: {p['p_reg']}",
+        f"8) Código de descuento: {p['cup']}",
+        f"9) Version: {p['ver']}",
+        f"10) URL Imagen: {p['imagen']}",
+        f"11) Enlace Importado: {p['url_imp']}",
+        f"12) Enlace Expandido: {p['url_exp']}",
+        f"13) URL importada sin afiliado: {p['url_importada_sin_afiliado']}",
+        f"14) URL sin acortar con mi afiliado: {p['url_sin_acortar_con_mi_afiliado']}",
+        f"15) URL acortada con mi afiliado: {p['url_oferta']}",
+        f"16) Enviado desde: {p['enviado_desde']}",
+        "17) Encolado para comparar con base de datos...",
+        "-" * 60,
+    ]))
+
 def obtener_datos_remotos():
     print("--- FASE 1: ESCANEANDO COMPRAS SMARTPHONE ---")
 
@@ -436,52 +787,88 @@ def obtener_datos_remotos():
         "Accept-Language": "es-ES,es;q=0.9",
     }
 
+    def _descargar_listado(url: str):
+        # GET condicional: si el listado no ha cambiado el servidor responde 304 sin cuerpo
+        # El cuerpo se guarda como bytes crudos (en latin-1, que es reversible byte a byte,
+        # para poder serializarlo en JSON): con 304 se devuelven los mismos bytes que con 200.
+        previo = cache_listados.get(url) or {}
+        h = dict(headers)
+        if previo.get("contenido"):
+            if previo.get("etag"):
+                h["If-None-Match"] = previo["etag"]
+            if previo.get("last_modified"):
+                h["If-Modified-Since"] = previo["last_modified"]
+        try:
+            r = scraper_session.get(url, headers=h, timeout=30)
+            if r.status_code == 304 and previo.get("contenido"):
+                return previo["contenido"].encode("latin-1"), None
+            if r.status_code == 200 and (r.headers.get("ETag") or r.headers.get("Last-Modified")):
+                cache_listados[url] = {
+                    "etag": r.headers.get("ETag", ""),
+                    "last_modified": r.headers.get("Last-Modified", ""),
+                    "contenido": r.content.decode("latin-1"),
+                }
+            # Bytes directamente al parser: selectolax detecta el charset sin pasar por str
+            return r.content, None
+        except Exception as e:
+            return b"", e
+
     # Deduplicamos por (nombre + ram + rom + fuente) para evitar dobles altas si el mismo producto aparece
     # en varias páginas (ofertas + marca, etc.). Para trazabilidad, acumulamos el/los orígenes en 'paginas_origen'.
     productos_por_clave = {}
-    fuentes_6_principales = ["MediaMarkt", "AliExpress Plaza", "PcComponentes", "Fnac", "Amazon", "Phone House"]
-
     if not URLS_PAGINAS:
         print("ERROR: No hay URLs configuradas. Define SOURCE_URL_COMPRAS o COMPRAS_URLS.")
         return []
 
-    for idx, url_listado in enumerate(URLS_PAGINAS, start=1):
+    # Descarga concurrente de todos los listados (I/O); el parseo sigue en un solo hilo
+    # para no tocar productos_por_clave desde varios hilos.
+    with ThreadPoolExecutor(max_workers=min(8, len(URLS_PAGINAS))) as executor:
+        descargas = list(executor.map(_descargar_listado, URLS_PAGINAS))
+
+    for idx, (url_listado, (html, error_descarga)) in enumerate(zip(URLS_PAGINAS, descargas), start=1):
         label = _label_pagina(url_listado)
         print("-" * 60)
         print(f"Escaneando listado ({idx}/{len(URLS_PAGINAS)}): {url_listado}")
 
         try:
-            r = requests.get(url_listado, headers=headers, timeout=30)
-            soup = BeautifulSoup(r.text, "lxml")
-            items = soup.select("ul.grid li")
+            if error_descarga:
+                raise error_descarga
+            tree = HTMLParser(html)
+            items = tree.css("ul.grid li")
             print(f"✅ Items detectados: {len(items)}")
 
             # Fallback Next.js: si el HTML no trae <li> (hidrata por JS), sacamos datos de __NEXT_DATA__
             items_json = []
             if len(items) == 0:
-                items_json = extraer_items_next_data(r.text)
+                items_json = extraer_items_next_data(tree)
                 print(f"✅ Items detectados (__NEXT_DATA__): {len(items_json)}")
 
+            candidatos = []
             for item in items:
                 try:
-                    link_el = item.select_one("a.text-white")
+                    link_el = item.css_first("a.text-white")
                     if not link_el:
                         continue
 
-                    raw_nombre = link_el.get_text(strip=True)
+                    raw_nombre = link_el.text(strip=True)
                     nombre = ' '.join(w[:1].upper() + w[1:] for w in raw_nombre.split())
 
                     if any(k in nombre.upper() for k in ["TAB", "IPAD", "PAD"]):
                         continue
 
-                    img = item.select_one("img")
-                    img_src = img["src"] if img else ""
-                    if "url=" in img_src:
-                        parsed_img = urllib.parse.parse_qs(urllib.parse.urlparse(img_src).query)
-                        if "url" in parsed_img:
-                            img_src = parsed_img["url"][0]
+                    img = item.css_first("img")
+                    img_src = (img.attributes.get("src") or "") if img else ""
+                    m_img = RE_IMG_URL.search(img_src)
+                    if m_img:
+                        img_src = urllib.parse.unquote_plus(m_img.group(1))
+
+                    # Nodos consultados una sola vez por item
+                    p_sm = item.css_first("p.text-sm")
+                    line_through = item.css_first("span.line-through")
+                    btn_cup = item.css_first("button.border-fluor-green")
+                    item_text = item.text()
 
-                    specs_text = item.select_one("p.text-sm").get_text(strip=True) if item.select_one("p.text-sm") else ""
+                    specs_text = p_sm.text(strip=True) if p_sm else ""
                     parts = specs_text.split("·")[0].replace("GB", "").split("/")
                     if len(parts) < 2:
                         continue
@@ -491,150 +878,38 @@ def obtener_datos_remotos():
                     ram = ram_part if "TB" in ram_part else f"{ram_part} GB"
                     rom = rom_part if "TB" in rom_part else f"{rom_part} GB"
 
-                    p_act = limpiar_precio(item.select_one("p.text-fluor-green").get_text(strip=True))
-                    p_reg = limpiar_precio(item.select_one("span.line-through").get_text(strip=True)) if item.select_one("span.line-through") else p_act
-
-                    btn = item.select_one("a.bg-fluor-green")
-                    url_imp = btn["href"] if btn else ""
-                    url_exp = expandir_url(url_imp)
-
-                    fuente = btn.get_text(strip=True).replace("Cómpralo en", "").strip() if btn else "Tienda"
-                    fuente_norm = (fuente or "").strip().lower()
-                    url_importada_sin_afiliado = url_exp
-
-                    # Normalización de URL sin parámetros según fuente
-                    if fuente == "MediaMarkt":
-                        url_importada_sin_afiliado = url_exp.split("?")[0]
-                    elif fuente == "AliExpress Plaza":
-                        url_importada_sin_afiliado = (
-                            url_exp.split(".html")[0] + ".html" if ".html" in url_exp else url_exp.split("?")[0]
-                        )
-                    elif fuente == "Fnac":
-                        # Mantener ?oref=...& y eliminar desde sv_ en adelante (incluyendo sv_)
-                        if "&sv_" in (url_exp or ""):
-                            url_importada_sin_afiliado = url_exp.split("&sv_")[0] + "&"
-                        elif "?sv_" in (url_exp or ""):
-                            url_importada_sin_afiliado = url_exp.split("?sv_")[0]
-                        else:
-                            url_importada_sin_afiliado = url_exp.split("?")[0]
-                    elif fuente in ["PcComponentes", "Amazon", "Phone House"]:
-                        url_importada_sin_afiliado = url_exp.split("?")[0]
-                    elif fuente_norm == "xiaomi store":
-                        url_importada_sin_afiliado = url_exp.split("?")[0]
-                    elif fuente_norm == "joom" or "joom.com/" in (url_exp or ""):
-                        url_importada_sin_afiliado = url_exp.split("?")[0]
-                    else:
-                        url_importada_sin_afiliado = url_exp
-
-                    # Seguridad extra: Joom siempre sin query
-                    if (fuente_norm == "joom") or ("joom.com/" in (url_exp or "")):
-                        url_importada_sin_afiliado = (url_exp or "").split("?")[0]
-
-                    # Construir URL con afiliado usando variables de entorno
-                    if fuente == "MediaMarkt" and ID_AFILIADO_MEDIAMARKT:
-                        url_sin_acortar_con_mi_afiliado = f"{url_importada_sin_afiliado}{ID_AFILIADO_MEDIAMARKT}"
-                    elif fuente == "AliExpress Plaza" and ID_AFILIADO_ALIEXPRESS:
-                        url_sin_acortar_con_mi_afiliado = f"{url_importada_sin_afiliado}{ID_AFILIADO_ALIEXPRESS}"
-                    elif fuente == "Fnac" and ID_AFILIADO_FNAC:
-                        aff = ID_AFILIADO_FNAC
-                        if url_importada_sin_afiliado.endswith("&") and aff.startswith("?"):
-                            aff = aff[1:]
-                        elif ("?" in url_importada_sin_afiliado) and aff.startswith("?") and (not url_importada_sin_afiliado.endswith("&")):
-                            aff = "&" + aff[1:]
-                        url_sin_acortar_con_mi_afiliado = f"{url_importada_sin_afiliado}{aff}"
-                    elif fuente == "Amazon" and ID_AFILIADO_AMAZON:
-                        url_sin_acortar_con_mi_afiliado = f"{url_importada_sin_afiliado}{ID_AFILIADO_AMAZON}"
-                    elif fuente == "Xiaomi Store" and ID_AFILIADO_XIAOMI_STORE:
-                        url_sin_acortar_con_mi_afiliado = f"{url_importada_sin_afiliado}{ID_AFILIADO_XIAOMI_STORE}"
-                    elif fuente == "El Corte Inglés" and ID_AFILIADO_ELCORTEINGLES:
-                        aff = ID_AFILIADO_ELCORTEINGLES
-                        if "?" in url_importada_sin_afiliado and aff.startswith("?"):
-                            aff = "&" + aff[1:]
-                        url_sin_acortar_con_mi_afiliado = f"{url_importada_sin_afiliado}{aff}"
-                    else:
-                        url_sin_acortar_con_mi_afiliado = url_importada_sin_afiliado
-
-                    url_oferta = acortar_url(url_sin_acortar_con_mi_afiliado)
-
-                    # Enviado desde
-                    tiendas_espana = [
-                        "pccomponentes",
-                        "aliexpress plaza",
-                        "mediamarkt",
-                        "amazon",
-                        "fnac",
-                        "phone house",
-                        "powerplanet",
-                    ]
-                    enviado_desde = ""
-                    if fuente.lower() in tiendas_espana or "Desde España" in item.get_text():
-                        enviado_desde = "España"
-
-                    enviado_desde_tg = ""
-                    if enviado_desde == "España":
-                        enviado_desde_tg = "🇪🇸 España"
-                    elif enviado_desde == "Europa":
-                        enviado_desde_tg = "🇪🇺 Europa"
-                    elif enviado_desde == "China":
-                        enviado_desde_tg = "🇨🇳 China"
-
-                    if fuente not in fuentes_6_principales:
-                        ver = "Global Version"
-                    else:
-                        ver = "Versión Global" if "Global" in item.get_text() or "Desde España" in item.get_text() else "N/A"
-
-                    cup = (
-                        item.select_one("button.border-fluor-green").get_text(strip=True).replace("Código", "").strip()
-                        if item.select_one("button.border-fluor-green")
-                        else "OFERTA PROMO"
-                    )
-
-                    # --- LOGS DETALLADOS SOLICITADOS ---
-                    print(f"Detectado {nombre}")
-                    print(f"1) Nombre: {nombre}")
-                    print(f"2) Memoria: {ram}")
-                    print(f"3) Capacidad: {rom}")
-                    print(f"4) Versión: {ver}")
-                    print(f"5) Fuente: {fuente}")
-                    print(f"6) Precio actual: {p_act}")
-                    print(f"7) Precio original: {p_reg}")
-                    print(f"8) Código de descuento: {cup}")
-                    print(f"9) Version: {ver}")
-                    print(f"10) URL Imagen: {img_src}")
-                    print(f"11) Enlace Importado: {url_imp}")
-                    print(f"12) Enlace Expandido: {url_exp}")
-                    print(f"13) URL importada sin afiliado: {url_importada_sin_afiliado}")
-                    print(f"14) URL sin acortar con mi afiliado: {url_sin_acortar_con_mi_afiliado}")
-                    print(f"15) URL acortada con mi afiliado: {url_oferta}")
-                    print(f"16) Enviado desde: {enviado_desde}")
-                    print(f"17) Encolado para comparar con base de datos...")
-                    print("-" * 60)
-                    # -----------------------------------
-
-                    clave = f"{nombre}|{ram}|{rom}|{fuente}".lower()
-                    if clave not in productos_por_clave:
-                        productos_por_clave[clave] = {
-                            "nombre": nombre,
-                            "p_act": p_act,
-                            "p_reg": p_reg,
-                            "ram": ram,
-                            "rom": rom,
-                            "ver": ver,
-                            "fuente": fuente,
-                            "cup": cup,
-                            "url_exp": url_exp,
-                            "url_imp": url_imp,
-                            "url_importada_sin_afiliado": url_importada_sin_afiliado,
-                            "url_sin_acortar_con_mi_afiliado": url_sin_acortar_con_mi_afiliado,
-                            "url_oferta": url_oferta,
-                            "imagen": img_src,
-                            "enviado_desde": enviado_desde,
-                            "enviado_desde_tg": enviado_desde_tg,
-                            "paginas_origen": {label},
-                        }
-                    else:
-                        # Si ya existía, agregamos origen adicional para trazabilidad.
-                        productos_por_clave[clave].setdefault("paginas_origen", set()).add(label)
+                    p_act = limpiar_precio(item.css_first("p.text-fluor-green").text(strip=True))
+                    p_reg = limpiar_precio(line_through.text(strip=True)) if line_through else p_act
+
+                    btn = item.css_first("a.bg-fluor-green")
+                    url_imp = (btn.attributes.get("href") or "") if btn else ""
+
+                    fuente = btn.text(strip=True).replace("Cómpralo en", "").strip() if btn else "Tienda"
+
+                    desde_espana = "Desde España" in item_text
+                    enviado_desde = detectar_enviado_desde(fuente, desde_espana)
+                    enviado_desde_tg = bandera_enviado_desde(enviado_desde)
+                    ver = detectar_version(fuente, desde_espana or "Global" in item_text)
+
+                    cup = btn_cup.text(strip=True).replace("Código", "").strip() if btn_cup else "OFERTA PROMO"
+
+                    candidatos.append({
+                        "nombre": nombre,
+                        "p_act": p_act,
+                        "p_reg": p_reg,
+                        "ram": ram,
+                        "rom": rom,
+                        "ver": ver,
+                        "fuente": fuente,
+                        "cup": cup,
+                        "url_exp": "",
+                        "url_imp": url_imp,
+                        "url_importada_sin_afiliado": "",
+                        "url_sin_acortar_con_mi_afiliado": "",
+                        "imagen": img_src,
+                        "enviado_desde": enviado_desde,
+                        "enviado_desde_tg": enviado_desde_tg,
+                    })
 
                 except Exception:
                     continue
@@ -678,89 +953,76 @@ def obtener_datos_remotos():
                     url_imp = (data.get("url_imp") or "").strip()
                     if not url_imp:
                         continue
-                    url_exp = expandir_url(url_imp)
 
                     fuente = (data.get("fuente") or "").strip() or "Tienda"
-                    fuente_norm = (fuente or "").strip().lower()
-                    url_importada_sin_afiliado = url_exp
-
-                    # Normalización de URL sin parámetros según fuente
-                    if fuente == "MediaMarkt":
-                        url_importada_sin_afiliado = url_exp.split("?")[0]
-                    elif fuente == "AliExpress Plaza":
-                        url_importada_sin_afiliado = (
-                            url_exp.split(".html")[0] + ".html" if ".html" in url_exp else url_exp.split("?")[0]
-                        )
-                    elif fuente == "Fnac":
-                        # Mantener ?oref=...& y eliminar desde sv_ en adelante (incluyendo sv_)
-                        if "&sv_" in (url_exp or ""):
-                            url_importada_sin_afiliado = url_exp.split("&sv_")[0] + "&"
-                        elif "?sv_" in (url_exp or ""):
-                            url_importada_sin_afiliado = url_exp.split("?sv_")[0]
-                        else:
-                            url_importada_sin_afiliado = url_exp.split("?")[0]
-                    elif fuente in ["PcComponentes", "Amazon", "Phone House", "El Corte Inglés", "Joom"]:
-                        url_importada_sin_afiliado = url_exp.split("?")[0]
-                    # Seguridad extra: Joom siempre sin query
-                    if (fuente_norm == "joom") or ("joom.com/" in (url_exp or "")):
-                        url_importada_sin_afiliado = (url_exp or "").split("?")[0]
-                    else:
-                        url_importada_sin_afiliado = url_exp.split("?")[0] if url_exp else url_exp
 
                     cup = "OFERTA PROMO"
-                    ver = detectar_version(nombre, fuente)
+                    ver = detectar_version(fuente)
                     enviado_desde = detectar_enviado_desde(fuente)
                     enviado_desde_tg = bandera_enviado_desde(enviado_desde)
 
-                    # Construir URL con afiliado usando variables de entorno (mismo comportamiento que el parser HTML)
-                    if fuente == "MediaMarkt" and ID_AFILIADO_MEDIAMARKT:
-                        url_sin_acortar_con_mi_afiliado = f"{url_importada_sin_afiliado}{ID_AFILIADO_MEDIAMARKT}"
-                    elif fuente == "AliExpress Plaza" and ID_AFILIADO_ALIEXPRESS:
-                        url_sin_acortar_con_mi_afiliado = f"{url_importada_sin_afiliado}{ID_AFILIADO_ALIEXPRESS}"
-                    elif fuente == "Fnac" and ID_AFILIADO_FNAC:
-                        aff = ID_AFILIADO_FNAC
-                        if url_importada_sin_afiliado.endswith("&") and aff.startswith("?"):
-                            aff = aff[1:]
-                        elif ("?" in url_importada_sin_afiliado) and aff.startswith("?") and (not url_importada_sin_afiliado.endswith("&")):
-                            aff = "&" + aff[1:]
-                        url_sin_acortar_con_mi_afiliado = f"{url_importada_sin_afiliado}{aff}"
-                    elif fuente == "Amazon" and ID_AFILIADO_AMAZON:
-                        url_sin_acortar_con_mi_afiliado = f"{url_importada_sin_afiliado}{ID_AFILIADO_AMAZON}"
-                    elif fuente == "Xiaomi Store" and ID_AFILIADO_XIAOMI_STORE:
-                        url_sin_acortar_con_mi_afiliado = f"{url_importada_sin_afiliado}{ID_AFILIADO_XIAOMI_STORE}"
-                    elif fuente == "El Corte Inglés" and ID_AFILIADO_ELCORTEINGLES:
-                        aff = ID_AFILIADO_ELCORTEINGLES
-                        if "?" in url_importada_sin_afiliado and aff.startswith("?"):
-                            aff = "&" + aff[1:]
-                        url_sin_acortar_con_mi_afiliado = f"{url_importada_sin_afiliado}{aff}"
-                    else:
-                        url_sin_acortar_con_mi_afiliado = url_importada_sin_afiliado
-
-                    url_oferta = acortar_url(url_sin_acortar_con_mi_afiliado)
-
-                    clave = f"{nombre}|{ram}|{rom}|{fuente}".lower()
-                    if clave not in productos_por_clave:
-                        productos_por_clave[clave] = {
-                            "nombre": nombre,
-                            "p_act": p_act,
-                            "p_reg": p_reg,
-                            "ram": ram,
-                            "rom": rom,
-                            "ver": ver,
-                            "fuente": fuente,
-                            "cup": cup,
-                            "url_exp": url_exp,
-                            "url_imp": url_imp,
-                            "url_importada_sin_afiliado": url_importada_sin_afiliado,
-                            "url_sin_acortar_con_mi_afiliado": url_sin_acortar_con_mi_afiliado,
-                            "url_oferta": url_oferta,
-                            "imagen": img_src,
-                            "enviado_desde": enviado_desde,
-                            "enviado_desde_tg": enviado_desde_tg,
-                        }
+                    candidatos.append({
+                        "nombre": nombre,
+                        "p_act": p_act,
+                        "p_reg": p_reg,
+                        "ram": ram,
+                        "rom": rom,
+                        "ver": ver,
+                        "fuente": fuente,
+                        "cup": cup,
+                        "url_exp": "",
+                        "url_imp": url_imp,
+                        "url_importada_sin_afiliado": "",
+                        "url_sin_acortar_con_mi_afiliado": "",
+                        "imagen": img_src,
+                        "enviado_desde": enviado_desde,
+                        "enviado_desde_tg": enviado_desde_tg,
+                    })
                 except Exception:
                     continue
 
+            # Expansión de enlaces en paralelo, solo para los items que han pasado los
+            # filtros (expandir_url está memoizada: el bucle de abajo lee lo ya resuelto).
+            urls_imp = {c["url_imp"] for c in candidatos if c["url_imp"]}
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS_URLS) as executor:
+                list(executor.map(expandir_url, urls_imp))
+
+            con_urls = []
+            for c in candidatos:
+                try:
+                    c["url_exp"] = expandir_url(c["url_imp"])
+                    c["url_importada_sin_afiliado"] = url_sin_afiliado(c["url_exp"], c["fuente"])
+                    c["url_sin_acortar_con_mi_afiliado"] = url_con_afiliado(c["url_importada_sin_afiliado"], c["fuente"])
+                except Exception:
+                    continue
+                con_urls.append(c)
+            candidatos = con_urls
+
+            # Acortado is.gd en paralelo (una petición por URL única y solo para las
+            # largas); después se imprime y deduplica en el orden del listado.
+            urls_a_acortar = list({
+                c["url_sin_acortar_con_mi_afiliado"] for c in candidatos
+                if len(c["url_sin_acortar_con_mi_afiliado"]) > LONGITUD_MAX_SIN_ACORTAR
+            })
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS_URLS) as executor:
+                acortadas = dict(zip(urls_a_acortar, executor.map(acortar_url, urls_a_acortar)))
+
+            for producto in candidatos:
+                url_afiliado = producto["url_sin_acortar_con_mi_afiliado"]
+                producto["url_oferta"] = acortadas.get(url_afiliado, url_afiliado)
+                imprimir_detalle_producto(producto)
+
+                # Clave normalizada una sola vez por producto; sincronizar la reutiliza
+                clave = producto["_clave"] = (
+                    producto['nombre'].lower(), str(producto['ram']).lower(),
+                    str(producto['rom']).lower(), str(producto['fuente']).lower(),
+                )
+                if clave not in productos_por_clave:
+                    producto["paginas_origen"] = {label}
+                    productos_por_clave[clave] = producto
+                else:
+                    # Si ya existía, agregamos origen adicional para trazabilidad.
+                    productos_por_clave[clave].setdefault("paginas_origen", set()).add(label)
 
         except Exception as e:
             print(f"❌ ERROR escaneando listado '{url_listado}': {e}")
@@ -776,37 +1038,129 @@ def obtener_datos_remotos():
     return productos_lista
 
 # --- FASE 2: SINCRONIZACIÓN ---
+def crear_producto(p, id_cat_padre, id_cat_hijo):
+    """Da de alta un producto remoto en WooCommerce (se ejecuta en el pool de hilos)."""
+    p_reg_s, p_act_s = str(p['p_reg']), str(p['p_act'])
+    data = {
+        "name": p['nombre'], "type": "simple", "status": "publish", "regular_price": p_reg_s, "sale_price": p_act_s,
+        "categories": [{"id": id_cat_padre}, {"id": id_cat_hijo}] if id_cat_hijo else [{"id": id_cat_padre}],
+        "images": [{"src": p['imagen']}] if p['imagen'] else [],
+        "meta_data": [
+            META_IMPORTADO_DE,
+            {"key": "memoria", "value": p['ram']},
+            {"key": "capacidad", "value": p['rom']},
+            {"key": "version", "value": p['ver']},
+            {"key": "fuente", "value": p['fuente']},
+            {"key": "precio_actual", "value": p_act_s},
+            {"key": "precio_original", "value": p_reg_s},
+            {"key": "codigo_de_descuento", "value": p['cup']},
+            {"key": "enlace_de_compra_importado", "value": p['url_imp']},
+            {"key": "url_oferta_sin_acortar", "value": p['url_exp']},
+            {"key": "url_importada_sin_afiliado", "value": p['url_importada_sin_afiliado']},
+            {"key": "url_sin_acortar_con_mi_afiliado", "value": p['url_sin_acortar_con_mi_afiliado']},
+            {"key": "url_oferta", "value": p['url_oferta']},
+            {"key": "enviado_desde", "value": p['enviado_desde']},
+            {"key": "enviado_desde_tg", "value": p['enviado_desde_tg']}
+        ]
+    }
+
+    # Un solo intento: WC_RETRY no reintenta POST (evita altas duplicadas); sin esperas fijas.
+    print(f"    ⏳ Creando {p['nombre']}...", flush=True)
+    try:
+        res = wcapi.post("products", data)
+        if res.status_code in [200, 201]:
+            prod_res = res.json()
+            new_id = prod_res['id']
+            product_url = prod_res.get('permalink')
+
+            # Acortar URL del post en la web propia si existe
+            url_post_acortada = acortar_url(product_url) if product_url else ""
+            if url_post_acortada:
+                wcapi.put(f"products/{new_id}", {
+                    "meta_data": [{"key": "url_post_acortada", "value": url_post_acortada}]
+                })
+
+            summary_creados.append({"nombre": p['nombre'], "id": new_id})
+            print(f"✅ CREADO -> {p['nombre']} (ID: {new_id})")
+        else:
+            print(f"⚠️ Error {res.status_code} al crear {p['nombre']}.", flush=True)
+    except Exception as e:
+        print(f"❌ Excepción durante la creación de {p['nombre']}: {e}", flush=True)
+
+def firma_oferta(p_act, p_reg, enviado_desde_tg):
+    """Tupla comparable (precio actual, precio original, envío); None si algún precio no es numérico."""
+    try:
+        return (float(p_act), float(p_reg), enviado_desde_tg)
+    except (TypeError, ValueError):
+        return None
+
+def enviar_lotes_wc(actualizaciones, eliminaciones):
+    """Envía updates/borrados por products/batch (WC_BATCH_MAX operaciones por petición), lotes en paralelo."""
+    ops = [("update", u) for u in actualizaciones] + [("delete", i) for i in eliminaciones]
+    lotes = []
+    for i in range(0, len(ops), WC_BATCH_MAX):
+        lote = {"update": [], "delete": []}
+        for tipo, op in ops[i:i + WC_BATCH_MAX]:
+            lote[tipo].append(op)
+        lotes.append(lote)
+
+    def _enviar(lote):
+        try:
+            res = wcapi.post("products/batch", lote)
+            if res.status_code not in [200, 201]:
+                print(f"⚠️ Error {res.status_code} en products/batch.", flush=True)
+        except Exception as e:
+            print(f"❌ Excepción en products/batch: {e}", flush=True)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS_WC) as executor:
+        list(executor.map(_enviar, lotes))
+
 def sincronizar(remotos):
     print("\n--- FASE 2: Sincronizando con WooCommerce ---")
     cache_categorias = obtener_todas_las_categorias()
-    locales_wc = []
-    page = 1
-    while True:
-        try:
-            res = wcapi.get("products", params={"per_page": 100, "page": page, "status": "any"}).json()
-            if not res or len(res) == 0:
-                break
-            locales_wc.extend(res)
-            page += 1
-        except:
-            break
-
+    # Sin filtro meta_key/meta_value en servidor: sería una coincidencia exacta y dejaría
+    # fuera las variantes del id (con "/" final) que sí cubre IDS_IMPORTACION.
+    # Estricto: un listado parcial haría recrear productos existentes y no borrar
+    # los obsoletos; mejor abortar la sincronización.
+    locales_wc = obtener_paginado_wc("products", {
+        "status": "any",
+        # Solo lo que usa la comparación: evita descargar descripciones, imágenes, etc.
+        "_fields": "id,name,meta_data",
+    }, estricto=True)
+
+    # Filtro local por importado_de (id normalizado y sus variantes)
     propios_en_wc = []
     for p in locales_wc:
-        meta = {m.get('key'): m.get('value') for m in (p.get('meta_data') or []) if isinstance(m, dict)}
-        imp = _norm_import_id(str(meta.get('importado_de', '') or ''))
-        if imp == ID_IMPORTACION_NORM:
+        # meta_data -> dict una sola vez; se reutiliza en la comparación de abajo
+        meta = {m.get('key'): str(m.get('value')) for m in (p.get('meta_data') or []) if isinstance(m, dict)}
+        imp = meta.get('importado_de', '')
+        # Comparación directa en el caso habitual; solo se normaliza si no coincide tal cual
+        if imp in IDS_IMPORTACION or _norm_import_id(imp) == ID_IMPORTACION_NORM:
+            p['_meta_dict'] = meta
+            p['_clave'] = (p['name'].lower(), str(meta.get('memoria')).lower(),
+                           str(meta.get('capacidad')).lower(), str(meta.get('fuente')).lower())
             propios_en_wc.append(p)
 
+    # Índice de remotos por (nombre, ram, rom, fuente): búsqueda O(1) por producto local.
+    # Los remotos ya vienen deduplicados por esa misma clave en obtener_datos_remotos.
+    remotos_por_clave = {}
+    for r in remotos:
+        remotos_por_clave.setdefault(r['_clave'], r)
+        r['_firma'] = firma_oferta(r['p_act'], r['p_reg'], r['enviado_desde_tg'])
+
+    # Updates y borrados se acumulan y se envían juntos por products/batch
+    actualizaciones = []
+    eliminaciones = []
     for local in propios_en_wc:
-        meta = {m['key']: str(m['value']) for m in local.get('meta_data', [])}
+        meta = local['_meta_dict']
         
-        match_remoto = next((r for r in remotos if r['nombre'].lower() == local['name'].lower() and 
-                             str(r['ram']).lower() == str(meta.get('memoria')).lower() and 
-                             str(r['rom']).lower() == str(meta.get('capacidad')).lower() and 
-                             str(r['fuente']).lower() == str(meta.get('fuente')).lower()), None)
+        match_remoto = remotos_por_clave.pop(local['_clave'], None)
         
-        if match_remoto:
+        if match_remoto and match_remoto['_firma'] is not None and match_remoto['_firma'] == firma_oferta(
+                meta.get('precio_actual', 0), meta.get('precio_original', 0), meta.get('enviado_desde_tg')):
+            # Camino rápido: mismos precios y envío -> nada que comparar campo a campo
+            summary_ignorados.append({"nombre": local['name'], "id": local['id']})
+        elif match_remoto:
             cambios = []
             update_data = {"meta_data": []}
             
@@ -831,73 +1185,36 @@ def sincronizar(remotos):
                 update_data["meta_data"].append({"key": "enviado_desde_tg", "value": match_remoto['enviado_desde_tg']})
             
             if cambios:
-                wcapi.put(f"products/{local['id']}", update_data)
+                actualizaciones.append({"id": local['id'], **update_data})
                 summary_actualizados.append({"nombre": local['name'], "id": local['id'], "cambios": cambios})
                 print(f"🔄 ACTUALIZADO -> {local['name']} (ID: {local['id']})")
             else:
                 summary_ignorados.append({"nombre": local['name'], "id": local['id']})
-            
-            remotos.remove(match_remoto)
         else:
-            wcapi.delete(f"products/{local['id']}", params={"force": True})
+            eliminaciones.append(local['id'])
             summary_eliminados.append({"nombre": local['name'], "id": local['id']})
             print(f"🗑️ ELIMINADO -> {local['name']} (ID: {local['id']})")
 
-    for p in remotos:
-        id_cat_padre, id_cat_hijo, _ = resolver_jerarquia(p['nombre'], cache_categorias)
-        data = {
-            "name": p['nombre'], "type": "simple", "status": "publish", "regular_price": str(p['p_reg']), "sale_price": str(p['p_act']),
-            "categories": [{"id": id_cat_padre}, {"id": id_cat_hijo}] if id_cat_hijo else [{"id": id_cat_padre}],
-            "images": [{"src": p['imagen']}] if p['imagen'] else [],
-            "meta_data": [
-                {"key": "importado_de", "value": ID_IMPORTACION_NORM},
-                {"key": "memoria", "value": p['ram']},
-                {"key": "capacidad", "value": p['rom']},
-                {"key": "version", "value": p['ver']},
-                {"key": "fuente", "value": p['fuente']},
-                {"key": "precio_actual", "value": str(p['p_act'])},
-                {"key": "precio_original", "value": str(p['p_reg'])},
-                {"key": "codigo_de_descuento", "value": p['cup']},
-                {"key": "enlace_de_compra_importado", "value": p['url_imp']},
-                {"key": "url_oferta_sin_acortar", "value": p['url_exp']},
-                {"key": "url_importada_sin_afiliado", "value": p['url_importada_sin_afiliado']},
-                {"key": "url_sin_acortar_con_mi_afiliado", "value": p['url_sin_acortar_con_mi_afiliado']},
-                {"key": "url_oferta", "value": p['url_oferta']},
-                {"key": "enviado_desde", "value": p['enviado_desde']},
-                {"key": "enviado_desde_tg", "value": p['enviado_desde_tg']}
-            ]
-        }
-
-        intentos = 0
-        max_intentos = 10
-        creado = False
-        
-        while intentos < max_intentos and not creado:
-            intentos += 1
-            print(f"    ⏳ Intentando crear {p['nombre']} (Intento {intentos}/{max_intentos})...", flush=True)
-            try:
-                res = wcapi.post("products", data)
-                if res.status_code in [200, 201]:
-                    prod_res = res.json()
-                    new_id = prod_res['id']
-                    product_url = prod_res.get('permalink')
-
-                    # Acortar URL del post en la web propia si existe
-                    url_post_acortada = acortar_url(product_url) if product_url else ""
-                    if url_post_acortada:
-                        wcapi.put(f"products/{new_id}", {
-                            "meta_data": [{"key": "url_post_acortada", "value": url_post_acortada}]
-                        })
-
-                    summary_creados.append({"nombre": p['nombre'], "id": new_id})
-                    print(f"✅ CREADO -> {p['nombre']} (ID: {new_id})")
-                    creado = True
-                else:
-                    print(f"⚠️ Error {res.status_code} al crear {p['nombre']}. Reintentando...", flush=True)
-            except Exception as e:
-                print(f"❌ Excepción durante la creación. Reintentando...", flush=True)
-            
-            time.sleep(60)
+    enviar_lotes_wc(actualizaciones, eliminaciones)
+
+    # Las categorías que falten se crean antes en bloque (padres y luego hijos, cada nivel
+    # en paralelo); así resolver_jerarquia solo consulta la caché y las altas de
+    # producto, que son I/O puro contra WordPress, van en paralelo.
+    crear_categorias_faltantes([p['nombre'] for p in remotos_por_clave.values()], cache_categorias)
+    # La búsqueda de categorías es lineal sobre cache_categorias: una vez por nombre
+    jerarquias = {}
+    pendientes = []
+    for p in remotos_por_clave.values():
+        clave_cat = p['nombre'].lower()
+        if clave_cat not in jerarquias:
+            jerarquias[clave_cat] = resolver_jerarquia(p['nombre'], cache_categorias)
+        id_cat_padre, id_cat_hijo, _ = jerarquias[clave_cat]
+        pendientes.append((p, id_cat_padre, id_cat_hijo))
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS_WC) as executor:
+        futuros = [executor.submit(crear_producto, p, padre, hijo) for p, padre, hijo in pendientes]
+        for futuro in as_completed(futuros):
+            futuro.result()
 
     hoy_fmt = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"\n============================================================")
@@ -19,7 +19,8 @@ Notas:
 - Genera logs estilo ODM.
 
 Requisitos:
-- requests, bs4, lxml
+- requests, bs4 (incluye soupsieve), lxml
+- (opcional) curl_cffi: huella TLS de Chrome para las descargas
 - (opcional fallback) playwright: playwright + navegador instalado (playwright install --with-deps chromium)
 """
 
@@ -27,9 +28,12 @@ import os
 import re
 import time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from urllib.parse import urljoin, urlparse, urlunparse, parse_qsl, urlencode
 
 import requests
+import soupsieve as sv
 from bs4 import BeautifulSoup
 
 SCRAPER_VERSION = "ECI_PREVIEW_v2.0_playwright_fallback"
@@ -48,6 +52,8 @@ CONNECT_TIMEOUT = float(os.getenv("ECI_CONNECT_TIMEOUT", "12"))
 READ_TIMEOUT = float(os.getenv("ECI_READ_TIMEOUT", "40"))
 FETCH_RETRIES = int(os.getenv("ECI_FETCH_RETRIES", "3"))
 FETCH_SLEEP = float(os.getenv("ECI_FETCH_SLEEP", "8"))
+PLP_WORKERS = int(os.getenv("ECI_PLP_WORKERS", "4"))
+CURL_IMPERSONATE = os.getenv("ECI_IMPERSONATE", "chrome123")
 
 MAX_PRODUCTS = os.getenv("MAX_PRODUCTS", "").strip()
 MAX_PRODUCTS = int(MAX_PRODUCTS) if MAX_PRODUCTS.isdigit() else None
@@ -68,8 +74,39 @@ DEFAULT_HEADERS = {
     "Upgrade-Insecure-Requests": "1",
 }
 
-SESSION = requests.Session()
-SESSION.headers.update(DEFAULT_HEADERS)
+def get_session():
+    """Sesión HTTP para ECI.
+
+    Si curl_cffi está instalado se usa con huella TLS de Chrome (ECI filtra por JA3 y
+    responde 403/challenge a clientes no navegador); si no, requests normal.
+    """
+    try:
+        from curl_cffi import requests as cffi_requests
+        s = cffi_requests.Session(impersonate=CURL_IMPERSONATE)
+    except ImportError:
+        s = requests.Session()
+    s.headers.update(DEFAULT_HEADERS)
+    return s
+
+
+SESSION = get_session()
+
+# Regex precompiladas (se usan por cada tarjeta/título de la PLP)
+RE_WS = re.compile(r"\s+")
+RE_SPLIT_WS = re.compile(r"(\s+)")
+RE_SPLIT_DASH = re.compile(r"(-)")
+RE_LETTER = re.compile(r"[A-Za-zÁÉÍÓÚÜÑáéíóúüñ]")
+RE_DIGIT = re.compile(r"\d")
+RE_SIZE = re.compile(r"(\d+(?:[.,]\d+)?)\s*(TB|GB)\b", re.IGNORECASE)
+RE_INT_DOT0 = re.compile(r"\d+\.0")
+# Grupos: (enteros con puntos de miles, céntimos) -> float sin pasos intermedios
+RE_PRICE_EUR = re.compile(r"\b(\d{1,3}(?:\.\d{3})*),(\d{2})\s*€\b")
+
+# Selectores CSS precompilados (soupsieve viene con bs4): se aplican por tarjeta
+SEL_CARDS = sv.compile("li.products_list-item article.product_preview")
+SEL_CARDS_FALLBACK = sv.compile("article.product_preview")
+SEL_CARD_TITLE = sv.compile("h2 a.product_preview-title, h2 a")
+SEL_CARD_IMG = sv.compile("img.js_preview_image, picture img, img")
 
 
 # --- Utilidades ---
@@ -82,7 +119,11 @@ def now_fmt():
 
 
 def clean_text(s: str) -> str:
-    return re.sub(r"\s+", " ", (s or "").replace("\xa0", " ")).strip()
+    s = (s or "").strip()
+    # Caso habitual: ya viene con espacios simples (isprintable() es False con \t, \n, \xa0...)
+    if "  " not in s and s.isprintable():
+        return s
+    return RE_WS.sub(" ", s.replace("\xa0", " ")).strip()
 
 
 def is_tablet_or_non_phone(name: str) -> bool:
@@ -97,7 +138,7 @@ def normalize_token(token: str) -> str:
     if not t:
         return t
     # Si contiene letras y números -> todo MAYÚSCULAS (ej: g85 -> G85, 14t -> 14T, 5g -> 5G)
-    if re.search(r"[A-Za-zÁÉÍÓÚÜÑáéíóúüñ]", t) and re.search(r"\d", t):
+    if RE_LETTER.search(t) and RE_DIGIT.search(t):
         return t.upper()
     # Si es todo mayúsculas (marca) lo pasamos a Title para consistencia
     if t.isupper() and len(t) > 2:
@@ -105,19 +146,21 @@ def normalize_token(token: str) -> str:
     return t[0].upper() + t[1:]
 
 
+# Las mismas tarjetas se repiten entre PLPs (Ofertas Límite / Móviles): memoizar
+@lru_cache(maxsize=4096)
 def normalize_name(name: str) -> str:
     name = clean_text(name)
     if not name:
         return name
     # separar conservando símbolos + y /
-    parts = re.split(r"(\s+)", name)
+    parts = RE_SPLIT_WS.split(name)
     out = []
     for p in parts:
         if p.isspace():
             out.append(p)
             continue
         # separar tokens por guiones pero preservarlos
-        subtoks = re.split(r"(-)", p)
+        subtoks = RE_SPLIT_DASH.split(p)
         subt_out = []
         for st in subtoks:
             if st == "-":
@@ -128,6 +171,7 @@ def normalize_name(name: str) -> str:
     return "".join(out)
 
 
+@lru_cache(maxsize=4096)
 def extract_ram_rom(title: str):
     """
     Extrae RAM y ROM del título tipo:
@@ -136,13 +180,13 @@ def extract_ram_rom(title: str):
     Devuelve ("12 GB", "256 GB") o (None, None)
     """
     t = (title or "").replace("\xa0", " ")
-    found = re.findall(r"(\d+(?:[.,]\d+)?)\s*(TB|GB)\b", t, flags=re.IGNORECASE)
+    found = RE_SIZE.findall(t)
     if len(found) < 2:
         return None, None
 
     def norm_size(num, unit):
         num = num.replace(",", ".")
-        if re.fullmatch(r"\d+\.0", num):
+        if RE_INT_DOT0.fullmatch(num):
             num = num[:-2]
         unit = unit.upper()
         return f"{num} {unit}"
@@ -152,27 +196,10 @@ def extract_ram_rom(title: str):
     return ram, rom
 
 
-def parse_price_to_number(price_str: str):
-    s = clean_text(price_str)
-    if not s:
-        return None
-    s = s.replace("€", "").strip()
-    s = s.replace(".", "").replace(",", ".")
-    try:
-        return float(s)
-    except Exception:
-        return None
-
-
 def pick_prices_from_text(txt: str):
     txt = (txt or "").replace("\xa0", " ")
-    prices = re.findall(r"\b\d{1,3}(?:\.\d{3})*(?:,\d{2})\s*€\b", txt)
-    prices = [p.strip() for p in prices]
-    if not prices:
-        return None, None
-
-    nums = [parse_price_to_number(p) for p in prices]
-    nums = [n for n in nums if n is not None]
+    # Una sola pasada: cada match ya trae enteros y céntimos separados
+    nums = [float(f"{ent.replace('.', '')}.{cent}") for ent, cent in RE_PRICE_EUR.findall(txt)]
     if not nums:
         return None, None
 
@@ -214,8 +241,7 @@ def make_600_square(img_url: str) -> str:
 def strip_query(url: str) -> str:
     if not url:
         return url
-    u = urlparse(url)
-    return urlunparse((u.scheme, u.netloc, u.path, "", "", ""))
+    return url.partition("?")[0].partition("#")[0]
 
 
 def add_affiliate(url_clean: str) -> str:
@@ -247,6 +273,11 @@ def fetch_with_requests(url: str) -> str:
         except Exception as e:
             last_err = e
             log(f"⚠️  Error fetch (requests) -> {type(e).__name__}: {e}")
+            # 4xx definitivo (403 antibot, 404...): reintentar con la misma sesión no
+            # cambia nada; se corta aquí y fetch_any pasa directamente a Playwright.
+            status = getattr(getattr(e, "response", None), "status_code", None)
+            if status is not None and 400 <= status < 500 and status not in (408, 429):
+                break
         if i < FETCH_RETRIES:
             log(f"⏳ Sleep {FETCH_SLEEP}s")
             time.sleep(FETCH_SLEEP)
@@ -274,52 +305,91 @@ def fetch_with_playwright(url: str) -> str:
                 page.wait_for_selector("li.products_list-item article.product_preview", timeout=int(READ_TIMEOUT * 1000))
             except Exception:
                 pass
-            page.wait_for_timeout(1500)
-            return page.content()
+            # Red en reposo (máx. 1.5s) en lugar de una pausa fija
+            try:
+                page.wait_for_load_state("networkidle", timeout=1500)
+            except Exception:
+                pass
+            # Solo el HTML de las tarjetas: evita serializar la página entera y volver a
+            # parsearla en Python (parse_products_from_plp_html cae al selector de article).
+            cards_html = page.eval_on_selector_all(
+                "article.product_preview", "els => els.map(e => e.outerHTML).join('')"
+            )
+            return cards_html or page.content()
         finally:
             context.close()
             browser.close()
 
 
-def fetch_any(url: str) -> str:
-    try:
-        return fetch_with_requests(url)
-    except Exception as e_req:
-        log(f"🧰 requests falló, probando playwright -> {type(e_req).__name__}: {e_req}")
-        return fetch_with_playwright(url)
+def fetch_all_with_requests(urls):
+    """Descarga en paralelo (requests) todas las PLP. Devuelve {url: (html, error)}."""
+    def _get(url):
+        try:
+            return fetch_with_requests(url), None
+        except Exception as e:
+            return None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(PLP_WORKERS, len(urls)))) as executor:
+        return dict(zip(urls, executor.map(_get, urls)))
+
+
+def fetch_any(url: str, prefetched=None) -> str:
+    """requests (o el resultado ya descargado en 'prefetched') y, si falla, Playwright."""
+    if prefetched is None:
+        try:
+            return fetch_with_requests(url)
+        except Exception as e:
+            prefetched = (None, e)
+    html, e_req = prefetched
+    if html is not None:
+        return html
+    log(f"🧰 requests falló, probando playwright -> {type(e_req).__name__}: {e_req}")
+    return fetch_with_playwright(url)
 
 
 # --- Parsing ---
 def parse_products_from_plp_html(html: str, plp_url: str):
     soup = BeautifulSoup(html, "lxml")
     products = []
-    nodes = soup.select("li.products_list-item article.product_preview")
+    nodes = SEL_CARDS.select(soup)
     if not nodes:
-        nodes = soup.select("article.product_preview")
+        nodes = SEL_CARDS_FALLBACK.select(soup)
 
+    vistos = set()
     for art in nodes:
         try:
             pid = art.get("id") or ""
-            a = art.select_one("h2 a.product_preview-title, h2 a")
+            a = SEL_CARD_TITLE.select_one(art)
             title_raw = clean_text(a.get_text(" ", strip=True)) if a else ""
             href = a.get("href") if a else ""
             url = urljoin("https://www.elcorteingles.es", href) if href else ""
             url_clean = strip_query(url)
 
-            img = art.select_one("img.js_preview_image, picture img, img")
+            # Descartes baratos (tablets, sin RAM/ROM, duplicados) antes de recorrer
+            # la tarjeta entera para precios e imagen
+            if is_tablet_or_non_phone(title_raw):
+                continue
+            # Sin "GB"/"TB" en el título no puede haber RAM+ROM: evita la regex
+            title_up = title_raw.upper()
+            if "GB" not in title_up and "TB" not in title_up:
+                continue
+            ram, rom = extract_ram_rom(title_raw)
+            if not ram or not rom:
+                continue
+            # Duplicados tras los filtros: una tarjeta descartada no oculta otra válida
+            clave = pid or url_clean
+            if clave:
+                if clave in vistos:
+                    continue
+                vistos.add(clave)
+
+            img = SEL_CARD_IMG.select_one(art)
             img_url = img.get("src") if img else ""
             img_url = make_600_square(img_url)
 
             art_txt = clean_text(art.get_text(" ", strip=True))
             precio_actual, precio_original = pick_prices_from_text(art_txt)
 
-            ram, rom = extract_ram_rom(title_raw)
-
-            if is_tablet_or_non_phone(title_raw):
-                continue
-            if not ram or not rom:
-                continue
-
             nombre_norm = normalize_name(title_raw)
             categoria = nombre_norm.split(" ")[0] if nombre_norm else ""
             version = "IOS" if categoria.lower() == "iphone" or "iphone" in nombre_norm.lower() else "Versión Global"
@@ -353,22 +423,25 @@ def parse_products_from_plp_html(html: str, plp_url: str):
 
 
 def print_product_log(p):
-    log(f"Detectado {p['nombre']}")
-    log(f"1) Nombre: {p['nombre']}")
-    log(f"2) Memoria: {p['memoria']}")
-    log(f"3) Capacidad: {p['capacidad']}")
-    log(f"4) Versión: {p['version']}")
-    log(f"5) Fuente: {p['fuente']}")
-    log(f"6) Precio actual: {p.get('precio_actual') or ''}")
-    log(f"7) Precio original: {p.get('precio_original') or ''}")
-    log(f"8) Código de descuento: {p['codigo_de_descuento']}")
-    log(f"9) Enviado desde: {p['enviado_desde']} ({p['enviado_desde_tg']})")
-    log(f"10) URL Imagen (600x600 preferida): {p.get('imagen_producto') or ''}")
-    log(f"11) Enlace (sin afiliado): {p.get('url_importada_sin_afiliado') or ''}")
-    log(f"12) Enlace (con mi afiliado): {p.get('url_sin_acortar_con_mi_afiliado') or ''}")
-    log(f"13) Importado de: {p.get('importado_de')}")
-    log(f"14) PLP origen: {p.get('plp_origen')}")
-    log("------------------------------------------------------------")
+    # Un único write+flush por producto
+    log("\n".join([
+        f"Detectado {p['nombre']}",
+        f"1) Nombre: {p['nombre']}",
+        f"2) Memoria: {p['memoria']}",
+        f"3) Capacidad: {p['capacidad']}",
+        f"4) Versión: {p['version']}",
+        f"5) Fuente: {p['fuente']}",
+        f"6) Precio actual: {p.get('precio_actual') or ''}",
+        f"7) Precio original: {p.get('precio_original') or ''}",
+        f"8) Código de descuento: {p['codigo_de_descuento']}",
+        f"9) Enviado desde: {p['enviado_desde']} ({p['enviado_desde_tg']})",
+        f"10) URL Imagen (600x600 preferida): {p.get('imagen_producto') or ''}",
+        f"11) Enlace (sin afiliado): {p.get('url_importada_sin_afiliado') or ''}",
+        f"12) Enlace (con mi afiliado): {p.get('url_sin_acortar_con_mi_afiliado') or ''}",
+        f"13) Importado de: {p.get('importado_de')}",
+        f"14) PLP origen: {p.get('plp_origen')}",
+        "------------------------------------------------------------",
+    ]))
 
 
 def main():
@@ -389,11 +462,17 @@ def main():
     all_products = []
     last_error = None
 
+    # La primera PLP va sola (caso habitual: basta con ella). Solo si falla o no da
+    # productos se piden las restantes a la vez por requests; Playwright para las que fallen.
+    descargas = {}
+
     for idx_url, plp in enumerate(PLP_URLS, start=1):
         log("------------------------------------------------------------")
         log(f"🔁 PROBANDO URL {idx_url}/{len(PLP_URLS)}: {plp}")
+        if idx_url == 2:
+            descargas = fetch_all_with_requests(PLP_URLS[1:])
         try:
-            html = fetch_any(plp)
+            html = fetch_any(plp, descargas.get(plp))
             prods = parse_products_from_plp_html(html, plp)
             log(f"✅ Descarga OK. Productos móviles detectados (con RAM+ROM): {len(prods)}")
             all_products.extend(prods)
@@ -6,8 +6,19 @@ import requests
 import json
 import urllib.parse
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from woocommerce import API
+import woocommerce.api as woocommerce_api
+
+# orjson (C) si está instalado; si no, json de la stdlib con la misma interfaz
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
 # ============================================================
 #  PHONEHOUSE SCRAPER (SCROLL + MASK + FULL PRODUCT FETCH)
@@ -48,6 +59,7 @@ if AFF_RAW and not AFF_RAW.startswith("?") and not AFF_RAW.startswith("&"):
 
 FUENTE = "Phone House"
 ID_IMPORTACION = "https://www.phonehouse.es"
+META_IMPORTADO_DE = {"key": "importado_de", "value": ID_IMPORTACION}  # compartido por todas las altas
 ENVIADO_DESDE = "España"
 ENVIADO_DESDE_TG = "🇪🇸 España"
 CODIGO_DESCUENTO = "OFERTA PROMO"
@@ -70,6 +82,24 @@ wcapi = API(
     timeout=60
 )
 
+# Sesión HTTP compartida (keep-alive) con reintentos con backoff ante 429/5xx:
+# sustituye a los reintentos manuales con esperas fijas.
+# POST queda fuera a propósito: un products/batch que WooCommerce ya ha aplicado
+# (timeout de lectura o 502/504 tras el commit) se reenviaría entero y crearía
+# duplicados. Solo se reintentan métodos idempotentes.
+HTTP_RETRY = Retry(
+    total=5,
+    backoff_factor=1.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=frozenset(["GET", "PUT", "DELETE"]),
+    raise_on_status=False,
+)
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=HTTP_RETRY))
+http_session.mount("http://", HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=HTTP_RETRY))
+# woocommerce.API hace cada llamada con requests.request(): la redirigimos a la sesión.
+woocommerce_api.request = http_session.request
+
 # Summaries
 summary_creados, summary_eliminados, summary_actualizados = [], [], []
 summary_ignorados, summary_sin_stock_nuevos, summary_fallidos = [], [], []
@@ -89,8 +119,23 @@ def calcular_precio_original(precio_actual: int, factor: float = 1.20) -> int:
         return 0
     return int(math.ceil(pa * factor))
 
+RE_WS = re.compile(r"\s+")
+# Patrones usados dentro de los helpers de descubrimiento/ficha (se llaman por bloque o por producto)
+RE_PRECIO_EUR = re.compile(r"\d{1,5}(?:[\.,]\d{1,2})?\s*€")
+RE_CLASE_TITULO = re.compile(r"marca|item|title|name|product", re.I)
+RE_LD_JSON = re.compile(r"ld\+json", re.I)
+# Nombres y precios (titlecase_product_name / parse_eur_*: una llamada por producto)
+RE_DIGITO = re.compile(r"\d")
+RE_LETRA = re.compile(r"[A-Za-zÁÉÍÓÚÜÑáéíóúüñ]")
+RE_PRECIO_EUR_NUM = re.compile(r"(\d{1,5}(?:[\.,]\d{1,2})?)\s*€")
+RE_NUM_PRECIO = re.compile(r"(\d{1,5}(?:[\.,]\d{1,2})?)")
+
 def normalize_spaces(s: str) -> str:
-    return re.sub(r"\s+", " ", (s or "")).strip()
+    s = (s or "").strip()
+    # Caso habitual: ya viene con espacios simples (isprintable() es False con \t, \n, \xa0...)
+    if "  " not in s and s.isprintable():
+        return s
+    return RE_WS.sub(" ", s)
 
 def titlecase_product_name(nombre: str) -> str:
     """Normaliza el nombre del móvil:
@@ -104,7 +149,7 @@ def titlecase_product_name(nombre: str) -> str:
     out_words = []
     for w in t.split():
         # Palabras tipo "g85", "14t", "5g", "a55s", etc.: letras en mayúscula
-        if re.search(r"\d", w) and re.search(r"[A-Za-zÁÉÍÓÚÜÑáéíóúüñ]", w):
+        if RE_DIGITO.search(w) and RE_LETRA.search(w):
             w2 = "".join(ch.upper() if ch.isalpha() else ch for ch in w)
         else:
             w2 = (w[:1].upper() + w[1:].lower()) if w else w
@@ -116,9 +161,9 @@ def titlecase_product_name(nombre: str) -> str:
 def mask_url(url: str) -> str:
     """Enmascara la URL para logs (no muestra querystring completa)."""
     try:
-        u = urllib.parse.urlsplit(url)
-        base = f"{u.scheme}://{u.netloc}{u.path}"
-        return base + ("?***" if u.query else "")
+        # Operaciones de cadena en lugar de urlsplit: se llama por cada log de producto
+        base, _, query = url.partition("#")[0].partition("?")
+        return base + ("?***" if query else "")
     except Exception:
         return "***"
 
@@ -145,7 +190,7 @@ def parse_eur_all(txt: str) -> list[int]:
         return []
     t = txt.replace("\xa0", " ").strip()
     vals = []
-    for m in re.findall(r"(\d{1,5}(?:[\.,]\d{1,2})?)\s*€", t):
+    for m in RE_PRECIO_EUR_NUM.findall(t):
         num = m.replace(".", "").replace(",", ".")
         try:
             vals.append(int(float(num)))
@@ -156,7 +201,7 @@ def parse_eur_all(txt: str) -> list[int]:
     t = txt.replace("\xa0", " ").strip()
 
     # Prioridad 1: números inmediatamente antes de '€'
-    matches = re.findall(r"(\d{1,5}(?:[\.,]\d{1,2})?)\s*€", t)
+    matches = RE_PRECIO_EUR_NUM.findall(t)
     if matches:
         num = matches[0].replace(".", "").replace(",", ".")
         try:
@@ -166,7 +211,7 @@ def parse_eur_all(txt: str) -> list[int]:
 
     # Prioridad 2: si hay símbolo euro pero con formato raro, intenta el último número
     if "€" in t:
-        nums = re.findall(r"\d{1,5}(?:[\.,]\d{1,2})?", t)
+        nums = RE_NUM_PRECIO.findall(t)
         if nums:
             num = nums[-1].replace(".", "").replace(",", ".")
             try:
@@ -175,7 +220,7 @@ def parse_eur_all(txt: str) -> list[int]:
                 return 0
 
     # Fallback conservador
-    m = re.search(r"(\d{1,5}(?:[\.,]\d{1,2})?)", t)
+    m = RE_NUM_PRECIO.search(t)
     if not m:
         return 0
     num = m.group(1).replace(".", "").replace(",", ".")
@@ -185,7 +230,7 @@ def parse_eur_all(txt: str) -> list[int]:
         return 0
     t = txt.replace("\xa0", " ").strip()
     # Ej: "1.239,00 €" o "999€"
-    m = re.search(r"(\d{1,5}(?:[.,]\d{1,2})?)", t)
+    m = RE_NUM_PRECIO.search(t)
     if not m:
         return 0
     num = m.group(1).replace(".", "").replace(",", ".")
@@ -198,11 +243,22 @@ def acortar_url(url_larga: str) -> str:
     """Acorta con is.gd (si falla, devuelve la original)."""
     try:
         url_encoded = urllib.parse.quote(url_larga, safe="")
-        r = requests.get(f"https://is.gd/create.php?format=simple&url={url_encoded}", timeout=10)
+        r = http_session.get(f"https://is.gd/create.php?format=simple&url={url_encoded}", timeout=10)
         return r.text.strip() if r.status_code == 200 else url_larga
     except Exception:
         return url_larga
 
+MAX_WORKERS_ACORTADOR = 16
+MAX_WORKERS_WC = 8
+
+def acortar_urls(urls) -> dict:
+    """Acorta varias URLs en paralelo con is.gd. Devuelve {url_larga: url_corta}."""
+    urls = [u for u in urls if u]
+    if not urls:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS_ACORTADOR, len(urls))) as executor:
+        return dict(zip(urls, executor.map(acortar_url, urls)))
+
 # --------------------------
 # RAM iPhone
 # --------------------------
@@ -249,6 +305,20 @@ def ram_por_modelo_iphone(nombre: str):
 # --------------------------
 # EXTRACCIÓN (título -> RAM/cap)
 # --------------------------
+# Formatos combo CAP+RAM o RAM+CAP (con + o /)
+RE_COMBO_CAP_RAM = re.compile(
+    r"(?P<cap>\d{2,4})\s*(?P<unit>TB|GB)\s*[\+/]\s*(?P<ram>\d{1,2})\s*GB(?:\s*RAM)?\b"
+    r"|(?P<ram2>\d{1,2})\s*GB(?:\s*RAM)?\s*[\+/]\s*(?P<cap2>\d{2,4})\s*(?P<unit2>TB|GB)\b",
+    re.I,
+)
+# Capacidad y RAM sueltas en una sola pasada (tamaños típicos; no se solapan)
+RE_CAP_O_RAM = re.compile(
+    r"\b(?P<cap_gb>64|128|256|512|1024)\s*GB\b|\b(?P<cap_tb>1|2)\s*TB\b"
+    r"|\b(?P<ram>3|4|6|8|12|16)\s*GB(?:\s*RAM)?\b",
+    re.I,
+)
+
+
 def extraer_nombre_memoria_capacidad(titulo: str):
     """
     Devuelve (nombre, capacidad, memoria).
@@ -258,12 +328,7 @@ def extraer_nombre_memoria_capacidad(titulo: str):
     t = normalize_spaces(titulo)
 
     # Formatos combo CAP+RAM o RAM+CAP (con + o /)
-    m_combo = re.search(
-        r"(?P<cap>\d{2,4})\s*(?P<unit>TB|GB)\s*[\+/]\s*(?P<ram>\d{1,2})\s*GB(?:\s*RAM)?\b"
-        r"|(?P<ram2>\d{1,2})\s*GB(?:\s*RAM)?\s*[\+/]\s*(?P<cap2>\d{2,4})\s*(?P<unit2>TB|GB)\b",
-        t,
-        flags=re.I
-    )
+    m_combo = RE_COMBO_CAP_RAM.search(t)
     if m_combo:
         if m_combo.group("cap") and m_combo.group("ram"):
             capacidad = f"{m_combo.group('cap')}{m_combo.group('unit').upper()}"
@@ -274,18 +339,24 @@ def extraer_nombre_memoria_capacidad(titulo: str):
         nombre = t[:m_combo.start()].strip()
         return normalize_spaces(nombre), capacidad, memoria
 
-    # Capacidad (almacenamiento)
-    m_cap = re.search(r"\b(64|128|256|512|1024)\s*GB\b|\b(1|2)\s*TB\b", t, flags=re.I)
+    # Capacidad (almacenamiento) y RAM: primera aparición de cada una
+    m_cap = m_ram = None
+    for m in RE_CAP_O_RAM.finditer(t):
+        if m.lastgroup == "ram":
+            m_ram = m_ram or m
+        else:
+            m_cap = m_cap or m
+        if m_cap and m_ram:
+            break
+
     capacidad = ""
     if m_cap:
-        if m_cap.group(1):
-            capacidad = f"{m_cap.group(1)}GB"
+        if m_cap.group("cap_gb"):
+            capacidad = f"{m_cap.group('cap_gb')}GB"
         else:
-            capacidad = f"{m_cap.group(2)}TB"
+            capacidad = f"{m_cap.group('cap_tb')}TB"
 
-    # RAM
-    m_ram = re.search(r"\b(3|4|6|8|12|16)\s*GB(?:\s*RAM)?\b", t, flags=re.I)
-    memoria = f"{m_ram.group(1)}GB" if m_ram else ""
+    memoria = f"{m_ram.group('ram')}GB" if m_ram else ""
 
     # Nombre
     cut_positions = []
@@ -297,6 +368,11 @@ def extraer_nombre_memoria_capacidad(titulo: str):
     nombre = t[:cut].strip()
     return normalize_spaces(nombre), capacidad, memoria
 
+# Ficha: capacidad/RAM típicas en el texto completo de la página
+RE_CAP_TIPICA = re.compile(r"\b(64|128|256|512|1024)\s*GB\b|\b(1|2)\s*TB\b", re.I)
+RE_RAM_CERCA = re.compile(r"(?:memoria\s*ram|ram)\D{0,30}\b(3|4|6|8|12|16)\s*gb\b", re.I)
+RE_RAM_TIPICA = re.compile(r"\b(3|4|6|8|12|16)\s*GB\b", re.I)
+
 def extraer_specs_ram_cap(soup: BeautifulSoup):
     """
     Intenta extraer RAM y capacidad desde la ficha, incluso si no están en el título.
@@ -309,19 +385,19 @@ def extraer_specs_ram_cap(soup: BeautifulSoup):
     # Capacidad
     cap = ""
     # Preferimos valores típicos de almacenamiento
-    m_cap = re.search(r"\b(64|128|256|512|1024)\s*GB\b|\b(1|2)\s*TB\b", text, flags=re.I)
+    m_cap = RE_CAP_TIPICA.search(text)
     if m_cap:
         cap = f"{m_cap.group(1)}GB" if m_cap.group(1) else f"{m_cap.group(2)}TB"
 
     # RAM
     ram = ""
     # Primero intenta cerca de "RAM"
-    m_ram = re.search(r"(?:memoria\s*ram|ram)\D{0,30}\b(3|4|6|8|12|16)\s*gb\b", text, flags=re.I)
+    m_ram = RE_RAM_CERCA.search(text)
     if m_ram:
         ram = f"{m_ram.group(1)}GB"
     else:
         # fallback: cualquier RAM típica; ojo: puede confundir con almacenamiento, pero priorizamos si ya hay cap
-        m_ram2 = re.search(r"\b(3|4|6|8|12|16)\s*GB\b", text, flags=re.I)
+        m_ram2 = RE_RAM_TIPICA.search(text)
         if m_ram2:
             ram = f"{m_ram2.group(1)}GB"
 
@@ -416,6 +492,7 @@ def obtener_productos_desde_dom(url: str, objetivo: int = 72, source_label: str
         from selenium.webdriver.chrome.options import Options
         from selenium.webdriver.support.ui import WebDriverWait
         from selenium.webdriver.support import expected_conditions as EC
+        from selenium.common.exceptions import TimeoutException
     except Exception as e:
         print(f"❌ Selenium no disponible: {e}", flush=True)
         return []
@@ -451,10 +528,18 @@ def obtener_productos_desde_dom(url: str, objetivo: int = 72, source_label: str
         print("🧭 Haciendo scroll hasta el final...", flush=True)
         last_h = 0
         stable = 0
+
+        def _altura_nueva(d):
+            alto = d.execute_script("return document.body.scrollHeight")
+            return alto if alto != last_h else False
+
         for _ in range(70):
             driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(1.2)
-            h = driver.execute_script("return document.body.scrollHeight")
+            # Seguimos en cuanto la página crece; 1.2s solo si no carga nada más
+            try:
+                h = WebDriverWait(driver, 1.2, poll_frequency=0.2).until(_altura_nueva)
+            except TimeoutException:
+                h = last_h
             if h == last_h:
                 stable += 1
             else:
@@ -638,11 +723,13 @@ def descubrir_urls_producto(html: str, base_url: str):
 
     Además, imprime diagnósticos básicos para entender cambios de HTML.
     """
-    soup = BeautifulSoup(html, "html.parser")
+    soup = BeautifulSoup(html, "lxml")
+    # Un único recorrido del documento para los enlaces /movil/...: se reutiliza
+    # tanto en el diagnóstico como en la búsqueda de tarjetas.
+    a_mov = soup.find_all("a", href=PRODUCT_PATH_RE)
 
     # Diagnósticos
     try:
-        a_mov = soup.find_all("a", href=PRODUCT_PATH_RE)
         print(f"   🧪 Diagnóstico: <a href='/movil/...'> encontrados: {len(a_mov)}", flush=True)
         n_precios = (len(soup.select('.precios-items-mosaico'))
                     + len(soup.select('.listado-precios-libre'))
@@ -661,11 +748,8 @@ def descubrir_urls_producto(html: str, base_url: str):
             txt = block.get_text(" ", strip=True)
             if "€" not in txt:
                 return False
-            if "otras ofertas" in txt.lower():
-                # no excluye, pero evita usarlo como única señal
-                pass
             # debe contener al menos un patrón numero+€
-            return bool(re.search(r"\d{1,5}(?:[\.,]\d{1,2})?\s*€", txt))
+            return bool(RE_PRECIO_EUR.search(txt))
         except Exception:
             return False
 
@@ -676,15 +760,26 @@ def descubrir_urls_producto(html: str, base_url: str):
             if len(t) >= 8:
                 return t
         # clases típicas
-        cand = block.find(attrs={"class": re.compile(r"marca|item|title|name|product", re.I)})
+        cand = block.find(attrs={"class": RE_CLASE_TITULO})
         if cand:
             t = normalize_spaces(cand.get_text(" ", strip=True))
             if len(t) >= 8:
                 return t
         return ""
 
+    # Varios enlaces de la misma tarjeta (imagen, título...) suben por los mismos
+    # ancestros: el resultado de cada bloque se calcula una sola vez.
+    bloques_evaluados = {}
+
+    def _es_tarjeta(block) -> bool:
+        clave = id(block)
+        ok = bloques_evaluados.get(clave)
+        if ok is None:
+            ok = bloques_evaluados[clave] = bool(_has_price(block) and _title_text(block))
+        return ok
+
     # Estrategia: partir de enlaces /movil/... y subir hasta un bloque que tenga precio+título
-    for a in soup.find_all("a", href=PRODUCT_PATH_RE):
+    for a in a_mov:
         href = (a.get("href") or "").strip()
         if not href:
             continue
@@ -704,7 +799,7 @@ def descubrir_urls_producto(html: str, base_url: str):
                 break
             if not getattr(block, "get_text", None):
                 continue
-            if _has_price(block) and _title_text(block):
+            if _es_tarjeta(block):
                 found = True
                 break
 
@@ -745,13 +840,13 @@ def fetch_ficha_producto(url: str, session: requests.Session, max_retries: int =
         Devuelve dict parcial.
         """
         out = {"titulo": "", "img": "", "price": 0.0, "price_original": 0.0}
-        scripts = soup.find_all("script", type=re.compile(r"ld\+json", re.I))
+        scripts = soup.find_all("script", type=RE_LD_JSON)
         for sc in scripts:
             raw = (sc.string or sc.get_text() or "").strip()
             if not raw:
                 continue
             try:
-                data = json.loads(raw)
+                data = json_loads(raw)
             except Exception:
                 continue
 
@@ -926,7 +1021,7 @@ def fetch_ficha_producto(url: str, session: requests.Session, max_retries: int =
                 time.sleep(1.0 * attempt)
                 continue
 
-            soup = BeautifulSoup(r.text, "html.parser")
+            soup = BeautifulSoup(r.text, "lxml")
 
             # Título
             titulo = ""
@@ -1044,19 +1139,59 @@ def obtener_datos_remotos():
     print(f"   Productos únicos encontrados: {len(productos)}", flush=True)
     return productos
 
-def obtener_todas_las_categorias():
-    categorias = []
-    page = 1
-    while True:
+def obtener_paginado_wc(recurso: str, params: dict | None = None, estricto: bool = False) -> list:
+    """GET paginado contra la API de WooCommerce.
+    La primera respuesta trae X-WP-TotalPages; el resto de páginas se piden en paralelo.
+    Con estricto=True cualquier página fallida (o un total que no cuadra con
+    X-WP-Total) lanza excepción en lugar de devolver una lista incompleta.
+    """
+    params = dict(params or {}, per_page=100)
+    try:
+        res = wcapi.get(recurso, params={**params, "page": 1})
+        primera = json_loads(res.content)
+    except Exception:
+        if estricto:
+            raise
+        return []
+    if not isinstance(primera, list):
+        if estricto:
+            raise RuntimeError(f"Respuesta inesperada de WooCommerce en {recurso} (página 1): {str(primera)[:200]}")
+        return []
+    try:
+        total_paginas = int(res.headers.get("X-WP-TotalPages", 1))
+    except (TypeError, ValueError):
+        total_paginas = 1
+
+    def _pagina(n):
         try:
-            res = wcapi.get("products/categories", params={"per_page": 100, "page": page}).json()
-            if not res or "message" in res or len(res) == 0:
-                break
-            categorias.extend(res)
-            page += 1
+            datos = json_loads(wcapi.get(recurso, params={**params, "page": n}).content)
         except Exception:
-            break
-    return categorias
+            if estricto:
+                raise
+            return []
+        if not isinstance(datos, list):
+            if estricto:
+                raise RuntimeError(f"Respuesta inesperada de WooCommerce en {recurso} (página {n}): {str(datos)[:200]}")
+            return []
+        return datos
+
+    resultados = list(primera)
+    if total_paginas > 1:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS_WC) as executor:
+            for datos in executor.map(_pagina, range(2, total_paginas + 1)):
+                resultados.extend(datos)
+
+    if estricto:
+        try:
+            total = int(res.headers.get("X-WP-Total", len(resultados)))
+        except (TypeError, ValueError):
+            total = len(resultados)
+        if total != len(resultados):
+            raise RuntimeError(f"Listado incompleto de {recurso}: {len(resultados)} de {total}")
+    return resultados
+
+def obtener_todas_las_categorias():
+    return obtener_paginado_wc("products/categories")
 
 def resolver_jerarquia(nombre_completo, cache_categorias):
     palabras = (nombre_completo or "").split()
@@ -1113,62 +1248,102 @@ def actualizar_imagen_categoria(cache_categorias, cat_id, img_src):
 # --------------------------
 # SINCRONIZACIÓN WC
 # --------------------------
+WC_BATCH_MAX = 100  # máximo de operaciones por petición en products/batch
+
+def wc_batch(tipo: str, items: list) -> list:
+    """POST products/batch en trozos de WC_BATCH_MAX.
+
+    Devuelve una respuesta por item, en el mismo orden que 'items'
+    (dict con 'id' si fue bien, o con 'error' si no).
+    """
+    resultados = []
+    for i in range(0, len(items), WC_BATCH_MAX):
+        trozo = items[i:i + WC_BATCH_MAX]
+        datos = []
+        try:
+            res = wcapi.post("products/batch", {tipo: trozo})
+            if res.status_code in (200, 201):
+                datos = json_loads(res.content).get(tipo) or []
+            else:
+                body_preview = (res.text or "")[:250].replace("\n", " ")
+                print(f"⚠️  Woo error {res.status_code} en batch {tipo}: {body_preview}", flush=True)
+        except Exception as e:
+            print(f"⚠️  Excepción Woo en batch {tipo}: {e}", flush=True)
+        datos = list(datos)[:len(trozo)]
+        datos += [{"error": {"message": "sin respuesta"}}] * (len(trozo) - len(datos))
+        resultados.extend(datos)
+    return resultados
+
 def sincronizar(remotos):
     print("\n--- FASE 2: SINCRONIZANDO ---", flush=True)
     cache_categorias = obtener_todas_las_categorias()
 
     # Cargar productos importados (por meta importado_de)
+    # Estricto: un listado parcial haría que los remotos ya importados se
+    # tomasen por nuevos y se duplicaran; mejor abortar la sincronización.
     locales = []
-    page = 1
-    while True:
-        res = wcapi.get("products", params={"per_page": 100, "page": page}).json()
-        if not res or "message" in res:
-            break
-        for p in res:
-            meta = {m["key"]: str(m.get("value", "")) for m in p.get("meta_data", [])}
-            if "phonehouse.es" in meta.get("importado_de", "").lower():
-                locales.append({"id": p["id"], "nombre": p.get("name", ""), "meta": meta})
-        if len(res) < 100:
-            break
-        page += 1
+    for p in obtener_paginado_wc("products", estricto=True):
+        meta = {m["key"]: str(m.get("value", "")) for m in p.get("meta_data", [])}
+        if "phonehouse.es" in meta.get("importado_de", "").lower():
+            locales.append({"id": p["id"], "nombre": p.get("name", ""), "meta": meta})
 
     print(f"📦 Productos Phone House existentes en la web: {len(locales)}", flush=True)
+
+    # Índice por enlace_de_compra_importado normalizado (se conserva el primero, como antes)
+    locales_por_url = {}
+    for l in locales:
+        clave = l["meta"].get("enlace_de_compra_importado", "").strip().split("?")[0].rstrip("/")
+        locales_por_url.setdefault(clave, l)
     print(f"📦 Productos remotos a procesar: {len(remotos)}", flush=True)
 
+    # is.gd en paralelo antes del bucle (I/O puro): el bucle solo lee el resultado
+    urls_afiliado = set()
+    for r in remotos:
+        url_base = (r.get("url_imp") or "").strip().split("?")[0]
+        urls_afiliado.add(f"{url_base}{AFF_RAW}" if AFF_RAW else url_base)
+    acortadas = acortar_urls(urls_afiliado)
+
+    # (padre, hijo) por nombre: el mismo modelo aparece varias veces (colores, tiendas)
+    jerarquias = {}
+    pendientes_update = []  # (payload con id, nombre, cambios)
+    pendientes_create = []  # (payload, nombre)
+
     for r in remotos:
         try:
-            # --- LOG DETALLADO (DEBUG) ---
-            print("-" * 60, flush=True)
-            print(f"Detectado {r.get('nombre','(sin nombre)')}", flush=True)
-            print(f"1) Nombre:          {r.get('nombre','')}", flush=True)
-            print(f"2) Memoria (RAM):   {r.get('memoria','')}", flush=True)
-            print(f"3) Capacidad:       {r.get('capacidad','')}", flush=True)
-            print(f"4) Versión ROM:     {r.get('version','Global')}", flush=True)
-            print(f"5) Precio Actual:   {r.get('precio_actual',0)}€", flush=True)
-            print(f"6) Precio Original: {r.get('precio_original',0)}€", flush=True)
-            print(f"7) Enviado desde:   {r.get('enviado_desde','')}", flush=True)
-            print(f"8) Importado de la página: {r.get('origen_pagina','?')}", flush=True)
+            # --- LOG DETALLADO (DEBUG) --- (un único write por producto)
             img = (r.get('img','') or '')
-            print(f"9) URL Imagen:      {(img[:75] + '...') if img else '(vacía)'}", flush=True)
-            print(f"10) Enlace Compra:  {mask_url(r.get('url_imp',''))}", flush=True)
-            print("-" * 60, flush=True)
+            print("\n".join([
+                "-" * 60,
+                f"Detectado {r.get('nombre','(sin nombre)')}",
+                f"1) Nombre:          {r.get('nombre','')}",
+                f"2) Memoria (RAM):   {r.get('memoria','')}",
+                f"3) Capacidad:       {r.get('capacidad','')}",
+                f"4) Versión ROM:     {r.get('version','Global')}",
+                f"5) Precio Actual:   {r.get('precio_actual',0)}€",
+                f"6) Precio Original: {r.get('precio_original',0)}€",
+                f"7) Enviado desde:   {r.get('enviado_desde','')}",
+                f"8) Importado de la página: {r.get('origen_pagina','?')}",
+                f"9) URL Imagen:      {(img[:75] + '...') if img else '(vacía)'}",
+                f"10) Enlace Compra:  {mask_url(r.get('url_imp',''))}",
+                "-" * 60,
+            ]))
+            # Precios como texto una sola vez (payload y meta_data de update/create)
+            p_act_s = str(r["precio_actual"])
+            p_orig_s = str(r["precio_original"])
             url_base = (r["url_imp"] or "").strip().split("?")[0]
             url_con_afiliado = f"{url_base}{AFF_RAW}" if AFF_RAW else url_base
-            url_oferta = acortar_url(url_con_afiliado)
+            url_oferta = acortadas.get(url_con_afiliado) or acortar_url(url_con_afiliado)
 
-            print(f"11) URL sin acortar con mi afiliado: {url_con_afiliado}", flush=True)
-            print(f"12) URL acortada con mi afiliado: {url_oferta}", flush=True)
+            print(f"11) URL sin acortar con mi afiliado: {url_con_afiliado}\n"
+                  f"12) URL acortada con mi afiliado: {url_oferta}", flush=True)
 
             # match por enlace_de_compra_importado
-            match = next(
-                (
-                    l for l in locales
-                    if l["meta"].get("enlace_de_compra_importado", "").strip().split("?")[0].rstrip("/") == url_base.rstrip("/")
-                ),
-                None
-            )
+            match = locales_por_url.get(url_base.rstrip("/"))
 
-            id_padre, id_hijo = resolver_jerarquia(r["nombre"], cache_categorias)
+            clave_cat = (r["nombre"] or "").lower()
+            if clave_cat not in jerarquias:
+                jerarquias[clave_cat] = resolver_jerarquia(r["nombre"], cache_categorias)
+            id_padre, id_hijo = jerarquias[clave_cat]
 
             img_subcat = obtener_imagen_categoria(cache_categorias, id_hijo)
             if (not img_subcat) and r.get("img"):
@@ -1195,20 +1370,16 @@ def sincronizar(remotos):
 
                 if cambios:
                     print(f'🔄 ACTUALIZANDO: {r["nombre"]} ({", ".join(cambios)})', flush=True)
-                    try:
-                        payload = {
-                            "regular_price": str(r["precio_original"]),
-                            "sale_price": str(r["precio_actual"]),
-                            "meta_data": [
-                                {"key": "precio_actual", "value": str(r["precio_actual"])},
-                                {"key": "precio_original", "value": str(r["precio_original"])},
-                            ],
-                        }
-                        wcapi.put(f'products/{match["id"]}', payload)
-                        summary_actualizados.append({"nombre": r["nombre"], "id": match["id"], "cambios": cambios})
-                    except Exception as e:
-                        print(f"❌ ERROR actualizando {r['nombre']}: {e}", flush=True)
-                        summary_fallidos.append({"nombre": r["nombre"], "id": match["id"], "error": str(e)})
+                    payload = {
+                        "id": match["id"],
+                        "regular_price": p_orig_s,
+                        "sale_price": p_act_s,
+                        "meta_data": [
+                            {"key": "precio_actual", "value": p_act_s},
+                            {"key": "precio_original", "value": p_orig_s},
+                        ],
+                    }
+                    pendientes_update.append((payload, r["nombre"], cambios))
                 else:
                     summary_ignorados.append({"nombre": r["nombre"], "id": match["id"]})
 
@@ -1218,19 +1389,19 @@ def sincronizar(remotos):
                     "name": r["nombre"],
                     "type": "simple",
                     "status": "publish",
-                    "regular_price": str(r["precio_original"]),
-                    "sale_price": str(r["precio_actual"]),
+                    "regular_price": p_orig_s,
+                    "sale_price": p_act_s,
                     "categories": [{"id": id_padre}, {"id": id_hijo}] if id_hijo else ([{"id": id_padre}] if id_padre else []),
                     "images": [{"src": img_final_producto}] if img_final_producto else [],
                     "meta_data": [
                         {"key": "nombre_movil_final", "value": r["nombre"]},
-                        {"key": "importado_de", "value": ID_IMPORTACION},
+                        META_IMPORTADO_DE,
                         {"key": "fecha", "value": r["fecha"]},
                         {"key": "memoria", "value": r["memoria"]},
                         {"key": "capacidad", "value": r["capacidad"]},
                         {"key": "fuente", "value": FUENTE},
-                        {"key": "precio_actual", "value": str(r["precio_actual"])},
-                        {"key": "precio_original", "value": str(r["precio_original"])},
+                        {"key": "precio_actual", "value": p_act_s},
+                        {"key": "precio_original", "value": p_orig_s},
                         {"key": "codigo_de_descuento", "value": CODIGO_DESCUENTO},
                         {"key": "enviado_desde", "value": ENVIADO_DESDE},
                         {"key": "enviado_desde_tg", "value": ENVIADO_DESDE_TG},
@@ -1242,48 +1413,42 @@ def sincronizar(remotos):
                         {"key": "version", "value": r.get("version","Global")},
                     ],
                 }
-
-                intentos = 0
-                max_intentos = 10
-                creado = False
-
-                while intentos < max_intentos and not creado:
-                    intentos += 1
-                    try:
-                        res = wcapi.post("products", data)
-                        if res.status_code in (200, 201):
-                            creado = True
-                            prod = res.json()
-                            summary_creados.append({"nombre": r["nombre"], "id": prod.get("id")})
-                            print(f"✅ CREADO -> ID: {prod.get('id')}", flush=True)
-
-                            # Acortar permalink del post
-                            try:
-                                url_short = acortar_url(prod.get("permalink", ""))
-                                if url_short:
-                                    wcapi.put(
-                                        f"products/{prod.get('id')}",
-                                        {"meta_data": [{"key": "url_post_acortada", "value": url_short}]},
-                                    )
-                            except Exception:
-                                pass
-                        else:
-                            body_preview = (res.text or "").replace("\n", " ")[:250]
-                            print(f"⚠️  Woo error {res.status_code}: {body_preview}", flush=True)
-                    except Exception as e:
-                        print(f"⚠️  Excepción Woo: {e}", flush=True)
-
-                    if (not creado) and (intentos < max_intentos):
-                        time.sleep(15)
-
-                if not creado:
-                    summary_fallidos.append(r.get("nombre", "desconocido"))
-                    print(f"❌ NO SE PUDO CREAR: {r.get('nombre','?')}", flush=True)
+                pendientes_create.append((data, r["nombre"]))
 
         except Exception as e:
             summary_fallidos.append(r.get("nombre", "desconocido"))
             print(f"❌ ERROR en {r.get('nombre','?')}: {e}", flush=True)
 
+    # Altas y actualizaciones en bloque (products/batch, hasta WC_BATCH_MAX por petición)
+    if pendientes_update:
+        resultados = wc_batch("update", [payload for payload, _, _ in pendientes_update])
+        for (payload, nombre, cambios), res in zip(pendientes_update, resultados):
+            if res.get("id"):
+                summary_actualizados.append({"nombre": nombre, "id": res["id"], "cambios": cambios})
+            else:
+                err = (res.get("error") or {}).get("message", "sin respuesta")
+                print(f"❌ ERROR actualizando {nombre}: {err}", flush=True)
+                summary_fallidos.append({"nombre": nombre, "id": payload["id"], "error": err})
+
+    if pendientes_create:
+        resultados = wc_batch("create", [data for data, _ in pendientes_create])
+        # Acortar permalinks de los posts creados (en paralelo)
+        permalinks_cortos = acortar_urls({res["permalink"] for res in resultados if res.get("permalink")})
+        urls_post = []
+        for (data, nombre), res in zip(pendientes_create, resultados):
+            if res.get("id"):
+                summary_creados.append({"nombre": nombre, "id": res["id"]})
+                print(f"✅ CREADO -> {nombre} (ID: {res['id']})", flush=True)
+                url_short = permalinks_cortos.get(res.get("permalink") or "", "")
+                if url_short:
+                    urls_post.append({"id": res["id"], "meta_data": [{"key": "url_post_acortada", "value": url_short}]})
+            else:
+                err = (res.get("error") or {}).get("message", "sin respuesta")
+                summary_fallidos.append(nombre)
+                print(f"❌ NO SE PUDO CREAR: {nombre} ({err})", flush=True)
+        if urls_post:
+            wc_batch("update", urls_post)
+
     # Resumen
     total = (
         len(summary_creados) + len(summary_eliminados) + len(summary_actualizados) +
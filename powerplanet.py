@@ -7,14 +7,23 @@ import math
 import re
 import time
 import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, asdict
 from datetime import datetime, timezone
-from typing import Dict, List, Optional, Tuple
+from html import unescape
+from typing import Dict, List, Optional, Tuple, Union
 from urllib.parse import urljoin, urlparse, parse_qsl, urlencode, urlunparse
 
 import requests
 from bs4 import BeautifulSoup
 
+# orjson (C) si está instalado; si no, json de la stdlib con la misma interfaz
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 BASE_URL = "https://www.powerplanetonline.com"
 LIST_URL = f"{BASE_URL}/es/moviles-mas-vendidos"
 
@@ -24,8 +33,44 @@ ENVIO_POWERPLANET = "España"
 CUPON_DEFAULT = "OFERTA PROMO"
 IMPORTADO_DE_POWERPLANET = BASE_URL  # ACF: importado_de
 
-
-@dataclass
+# --- REGEX PRECOMPILADAS (se usan por cada oferta del listado) ---
+RE_WS = re.compile(r"\s+")
+RE_SPLIT_GUION = re.compile(r"(-)")
+RE_NO_ALNUM = re.compile(r"[^0-9A-Za-z]+")
+RE_PRECIO_EUR = re.compile(r"(\d[\d\.\,]*)\s*€")
+RE_PCT = re.compile(r"-\s*(\d{1,3})\s*%")
+RE_PVR = re.compile(r"\bPVR\b", re.IGNORECASE)
+RE_PVR_PRECIOS = re.compile(r"PVR\s*([0-9\.\,]+)\s*€\s*([0-9\.\,]+)\s*€", re.IGNORECASE)
+RE_EUROS = re.compile(r"\d[\d\.\,]*\s*€")
+RE_OPINIONES = re.compile(r"\((\d+)\s*opiniones\)", re.IGNORECASE)
+RE_OUKITEL = re.compile(r"^oukitel\b")
+
+# Ficha: atributo data-product e <img id="main-image"> sin construir el DOM completo
+RE_DATA_PRODUCT = re.compile(r"<form\b[^>]*?\sdata-product=([\"'])(.*?)\1", re.IGNORECASE | re.DOTALL)
+RE_MAIN_IMG = re.compile(r"<img\b[^>]*?\sid=[\"']main-image[\"'][^>]*>", re.IGNORECASE)
+RE_IMG_ATTR = re.compile(r"\s(data-original|src)=([\"'])(.*?)\2", re.IGNORECASE | re.DOTALL)
+
+# RAM/ROM por orden de prioridad (el primero que encaje gana, aunque otro aparezca antes
+# en el título): 4B128GB (slugs) | 8GB/256GB, 8GB+256GB, 8GB-256GB | 8GB 256GB | 8GB256GB
+RES_MEM_RAM_ROM = (
+    re.compile(r"\b(\d+)\s*b\s*(\d+)\s*(GB|TB)\b", re.IGNORECASE),
+    re.compile(r"(\d+)\s*(GB|TB)\s*[/\+\-\|]\s*(\d+)\s*(GB|TB)", re.IGNORECASE),
+    re.compile(r"\b(\d+)\s*(GB|TB)\s+(\d+)\s*(GB|TB)\b", re.IGNORECASE),
+    re.compile(r"\b(\d+)\s*(GB)\s*(\d+)\s*(GB|TB)\b", re.IGNORECASE),
+)
+RE_MEM_URL = re.compile(r"-(\d+)gb-(\d+)gb(?:-|\b)")
+RE_MEM_TOKEN = re.compile(r"\b(\d+)\s*(GB|TB)\b", re.IGNORECASE)
+
+# Bloques RAM/ROM a quitar del nombre (8GB/256GB, 8GB 256GB, 4B128GB, 8GB128GB), en este orden
+RES_VARIANTE_MEM = (
+    re.compile(r"\s*\b\d+\s*(?:GB|TB)\s*[/\+\-\|]\s*\d+\s*(?:GB|TB)\b\s*", re.IGNORECASE),
+    re.compile(r"\s*\b\d+\s*(?:GB|TB)\s+\d+\s*(?:GB|TB)\b\s*", re.IGNORECASE),
+    re.compile(r"\s*\b\d+\s*b\s*\d+\s*(?:GB|TB)\b\s*", re.IGNORECASE),
+    re.compile(r"\s*\b\d+\s*GB\s*\d+\s*(?:GB|TB)\b\s*", re.IGNORECASE),
+)
+
+
+@dataclass(slots=True)
 class Offer:
     source: str
     name: str
@@ -79,7 +124,7 @@ def smart_title_token(token: str) -> str:
     raw = token.strip()
 
     # Preservar separadores internos (muy típico: "Pro+", etc.)
-    parts = re.split(r"(-)", raw)
+    parts = RE_SPLIT_GUION.split(raw)
     out_parts: List[str] = []
     for p in parts:
         if p == "-":
@@ -112,7 +157,7 @@ def smart_title_token(token: str) -> str:
 
 def format_product_title(name: str) -> str:
     # Normaliza espacios y capitaliza tokens
-    name = re.sub(r"\s+", " ", (name or "").strip())
+    name = RE_WS.sub(" ", (name or "").strip())
     tokens = name.split(" ") if name else []
     return " ".join(smart_title_token(t) for t in tokens)
 
@@ -130,7 +175,7 @@ def strip_after_4g_5g(nombre_5g: str) -> str:
     tokens = nombre_5g.split()
     kept: List[str] = []
     for tok in tokens:
-        tok_clean = re.sub(r"[^0-9A-Za-z]+", "", tok).lower()
+        tok_clean = RE_NO_ALNUM.sub("", tok).lower()
         if tok_clean in {"4g", "5g"}:
             break
         kept.append(tok)
@@ -144,7 +189,7 @@ def build_nombre_fields(raw_name: str) -> Tuple[str, str]:
       - nombre_5g: EXACTAMENTE lo que imprimimos tras 'Detectado ...' (ACF 'nombre_5g')
       - nombre: nombre limpio para Woo (sin 4G/5G y sin el resto de especificaciones)
     """
-    nombre_5g = format_product_title(re.sub(r"\s+", " ", (raw_name or "").strip()))
+    nombre_5g = format_product_title(RE_WS.sub(" ", (raw_name or "").strip()))
 
     # Nombre base: cortar en 4G/5G y limpiar variantes habituales (RAM/ROM + color final)
     nombre_base = strip_after_4g_5g(nombre_5g)
@@ -167,7 +212,7 @@ def parse_eur_amount(s: str) -> Optional[float]:
     if not s:
         return None
     s = s.strip().replace("\xa0", " ")
-    m = re.search(r"(\d[\d\.\,]*)\s*€", s)
+    m = RE_PRECIO_EUR.search(s)
     if not m:
         return None
     num = m.group(1).replace(".", "").replace(",", ".")
@@ -178,7 +223,7 @@ def parse_eur_amount(s: str) -> Optional[float]:
 
 
 def parse_pct(s: str) -> Optional[int]:
-    m = re.search(r"-\s*(\d{1,3})\s*%", s)
+    m = RE_PCT.search(s)
     if not m:
         return None
     try:
@@ -187,8 +232,8 @@ def parse_pct(s: str) -> Optional[int]:
         return None
 
 
-def parse_int_from(s: str, pattern: str) -> Optional[int]:
-    m = re.search(pattern, s, flags=re.IGNORECASE)
+def parse_int_from(s: str, pattern: "re.Pattern[str]") -> Optional[int]:
+    m = pattern.search(s)
     if not m:
         return None
     try:
@@ -197,17 +242,6 @@ def parse_int_from(s: str, pattern: str) -> Optional[int]:
         return None
 
 
-def parse_float_from(s: str, pattern: str) -> Optional[float]:
-    m = re.search(pattern, s, flags=re.IGNORECASE)
-    if not m:
-        return None
-    val = m.group(1).strip().replace(",", ".")
-    try:
-        return float(val)
-    except ValueError:
-        return None
-
-
 def truncate_price(v: Optional[float]) -> Optional[int]:
     """Trunca el precio eliminando decimales (174.99 -> 174)."""
     if v is None:
@@ -240,48 +274,25 @@ def extract_ram_rom_from_name(name: str, url: str = "") -> Tuple[str, str]:
 
     n = (name or "").replace("\xa0", " ").strip()
 
-    # 4B128GB (slugs)
-    m = re.search(r"\b(\d+)\s*b\s*(\d+)\s*(GB|TB)\b", n, flags=re.IGNORECASE)
-    if m:
-        ram = f"{m.group(1)}GB"
-        rom = f"{m.group(2)}{m.group(3).upper()}"
-        return ram, rom
-
-    # 8GB/256GB, 8GB+256GB, 8GB-256GB, 8GB|256GB
-    m = re.search(r"(\d+)\s*(GB|TB)\s*[/\+\-\|]\s*(\d+)\s*(GB|TB)", n, flags=re.IGNORECASE)
-    if m:
-        ram = f"{m.group(1)}{m.group(2).upper()}"
-        rom = f"{m.group(3)}{m.group(4).upper()}"
-        return ram, rom
-
-    # 8GB 256GB
-    m = re.search(r"\b(\d+)\s*(GB|TB)\s+(\d+)\s*(GB|TB)\b", n, flags=re.IGNORECASE)
-    if m:
-        ram = f"{m.group(1)}{m.group(2).upper()}"
-        rom = f"{m.group(3)}{m.group(4).upper()}"
-        return ram, rom
-
-    # 8GB256GB (sin separador)
-    m = re.search(r"\b(\d+)\s*GB\s*(\d+)\s*(GB|TB)\b", n, flags=re.IGNORECASE)
-    if m:
-        ram = f"{m.group(1)}GB"
-        rom = f"{m.group(2)}{m.group(3).upper()}"
-        return ram, rom
+    # Precompilados a nivel de módulo; se prueban en orden de prioridad
+    for i, rx in enumerate(RES_MEM_RAM_ROM):
+        m = rx.search(n)
+        if not m:
+            continue
+        if i == 0:
+            return f"{m.group(1)}GB", f"{m.group(2)}{m.group(3).upper()}"
+        return f"{m.group(1)}{m.group(2).upper()}", f"{m.group(3)}{m.group(4).upper()}"
 
     # Fallback URL: ...-8gb-256gb-...
     if url:
-        try:
-            p = urlparse(url)
-            path = (p.path or "").lower()
-            m = re.search(r"-(\d+)gb-(\d+)gb(?:-|\b)", path)
-            if m:
-                return f"{m.group(1)}GB", f"{m.group(2)}GB"
-        except Exception:
-            pass
+        path = url.partition("?")[0].partition("#")[0].lower()
+        m = RE_MEM_URL.search(path)
+        if m:
+            return f"{m.group(1)}GB", f"{m.group(2)}GB"
 
     # Heurística: capturar todos los tokens GB/TB y deducir RAM/ROM
     vals_gb: List[int] = []
-    for mm in re.finditer(r"\b(\d+)\s*(GB|TB)\b", n, flags=re.IGNORECASE):
+    for mm in RE_MEM_TOKEN.finditer(n):
         try:
             v = int(mm.group(1))
             unit = (mm.group(2) or "").upper()
@@ -318,22 +329,13 @@ def strip_variant_from_name(name: str) -> str:
     if not name:
         return name
 
-    s = re.sub(r"\s+", " ", name.strip())
+    s = RE_WS.sub(" ", name.strip())
 
     # Quitar RAM/ROM (varios formatos)
-    for pat in (
-        # 8GB/256GB, 8GB+256GB, 8GB-256GB
-        r"\s*\b\d+\s*(?:GB|TB)\s*[/\+\-\|]\s*\d+\s*(?:GB|TB)\b\s*",
-        # 8GB 256GB
-        r"\s*\b\d+\s*(?:GB|TB)\s+\d+\s*(?:GB|TB)\b\s*",
-        # 4B128GB (slugs)
-        r"\s*\b\d+\s*b\s*\d+\s*(?:GB|TB)\b\s*",
-        # 8GB128GB (sin separador explícito)
-        r"\s*\b\d+\s*GB\s*\d+\s*(?:GB|TB)\b\s*",
-    ):
-        s = re.sub(pat, " ", s, flags=re.IGNORECASE)
-
-    s = re.sub(r"\s+", " ", s).strip()
+    for rx in RES_VARIANTE_MEM:
+        s = rx.sub(" ", s)
+
+    s = RE_WS.sub(" ", s).strip()
 
     # Quitar color final (si coincide con lista típica)
     colors = {
@@ -348,7 +350,7 @@ def strip_variant_from_name(name: str) -> str:
     if parts and normalize_text(parts[-1]) in colors:
         s = " ".join(parts[:-1]).strip()
 
-    return re.sub(r"\s+", " ", s).strip()
+    return RE_WS.sub(" ", s).strip()
 
 
 def compute_version(clean_name: str) -> str:
@@ -369,9 +371,13 @@ def build_affiliate_url(url: str, affiliate_query: str) -> str:
     if not affiliate_query.strip():
         return url
 
+    extra = dict(parse_qsl(affiliate_query, keep_blank_values=True))
+    # Caso habitual (URL de ficha sin query ni fragmento): concatenar sin urlparse/urlunparse
+    if "?" not in url and "#" not in url:
+        return f"{url}?{urlencode(extra, doseq=True)}"
+
     parsed = urlparse(url)
     current = dict(parse_qsl(parsed.query, keep_blank_values=True))
-    extra = dict(parse_qsl(affiliate_query, keep_blank_values=True))
     current.update(extra)
 
     new_query = urlencode(current, doseq=True)
@@ -425,12 +431,35 @@ def fetch_html(sess: requests.Session, url: str, timeout: int = 25, retries: int
     raise RuntimeError(f"Error descargando {url}: {last_err}")
 
 
+def fetch_html_many(
+    sess: requests.Session, urls: List[str], timeout: int, sleep_seconds: float, workers: int
+) -> Dict[str, Union[str, Exception]]:
+    """Descarga varias fichas en paralelo (pool acotado, misma sesión keep-alive).
+
+    Cada hilo respeta `sleep_seconds` antes de su request, así que el ritmo por
+    conexión es el mismo que en secuencial pero con `workers` peticiones en vuelo.
+    Una ficha que falla devuelve su excepción en lugar del HTML, para que quien
+    consume decida en qué oferta cortar (las anteriores ya quedan procesadas).
+    """
+
+    def _fetch(url: str) -> Union[str, Exception]:
+        if sleep_seconds > 0:
+            time.sleep(sleep_seconds)
+        try:
+            return fetch_html(sess, url, timeout=timeout)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        return dict(zip(urls, ex.map(_fetch, urls)))
+
+
 def extract_listing_candidates(list_html: str) -> List[Offer]:
-    soup = BeautifulSoup(list_html, "html.parser")
+    soup = BeautifulSoup(list_html, "lxml")
     offers: Dict[str, Offer] = {}
 
     # Heurística: encontrar bloques que contengan "PVR" y extraer nombre/URL/precios
-    pvr_nodes = soup.find_all(string=re.compile(r"\bPVR\b", re.IGNORECASE))
+    pvr_nodes = soup.find_all(string=RE_PVR)
     for node in pvr_nodes:
         container = node.parent
         chosen = None
@@ -468,19 +497,19 @@ def extract_listing_candidates(list_html: str) -> List[Offer]:
         chosen_text = chosen.get_text(" ", strip=True)
         block_text = chosen_container.get_text(" ", strip=True).replace("\xa0", " ")
 
-        m = re.search(r"PVR\s*([0-9\.\,]+)\s*€\s*([0-9\.\,]+)\s*€", block_text, re.IGNORECASE)
+        m = RE_PVR_PRECIOS.search(block_text)
         pvr = price = None
         if m:
             pvr = parse_eur_amount(m.group(1) + "€")
             price = parse_eur_amount(m.group(2) + "€")
         else:
-            euros = re.findall(r"\d[\d\.\,]*\s*€", block_text)
+            euros = RE_EUROS.findall(block_text)
             if len(euros) >= 2:
                 pvr = parse_eur_amount(euros[0])
                 price = parse_eur_amount(euros[1])
 
         discount = parse_pct(block_text)
-        reviews = parse_int_from(block_text, r"\((\d+)\s*opiniones\)")
+        reviews = parse_int_from(block_text, RE_OPINIONES)
 
         offers[url] = Offer(
             source=FUENTE_POWERPLANET,
@@ -502,22 +531,37 @@ def parse_product_data_json(soup: BeautifulSoup) -> Optional[dict]:
     form = soup.find("form", attrs={"data-product": True})
     if not form:
         return None
-    raw = form.get("data-product")
+    return decode_data_product(form.get("data-product"))
+
+
+def decode_data_product(raw: Optional[str]) -> Optional[dict]:
     if not raw:
         return None
     try:
-        return json.loads(raw)
+        return json_loads(raw)
     except Exception:
         return None
 
 
 def parse_detail_fields(detail_html: str) -> Dict[str, Optional[object]]:
-    """PowerPlanet: prioriza el JSON data-product para nombre/sku/precios."""
-    soup = BeautifulSoup(detail_html, "html.parser")
+    """PowerPlanet: prioriza el JSON data-product para nombre/sku/precios.
+
+    data-product e imagen se sacan por regex; BeautifulSoup solo se construye
+    si alguno de los dos no aparece (o falta el nombre).
+    """
     out: Dict[str, Optional[object]] = {}
 
+    m_data = RE_DATA_PRODUCT.search(detail_html)
+    data = decode_data_product(unescape(m_data.group(2))) if m_data else None
+    m_img = RE_MAIN_IMG.search(detail_html)
+
+    soup = None
+    if data is None or m_img is None:
+        soup = BeautifulSoup(detail_html, "lxml")
+        if data is None:
+            data = parse_product_data_json(soup)
+
     # 1) Fuente de verdad: data-product JSON
-    data = parse_product_data_json(soup)
     if data:
         out["product_id"] = data.get("id")
         out["ref"] = data.get("sku")
@@ -532,12 +576,18 @@ def parse_detail_fields(detail_html: str) -> Dict[str, Optional[object]]:
         out["category_path"] = data.get("mainCategoryName")
 
     # 2) Imagen principal (src o data-original)
-    img = soup.select_one("img#main-image") or soup.select_one("img.mainImageTag")
-    if img:
-        out["image_large"] = (img.get("data-original") or img.get("src") or "").strip() or None
+    if m_img is not None:
+        attrs = {k.lower(): v for k, _, v in RE_IMG_ATTR.findall(m_img.group(0))}
+        out["image_large"] = unescape(attrs.get("data-original") or attrs.get("src") or "").strip() or None
+    else:
+        img = soup.select_one("img#main-image") or soup.select_one("img.mainImageTag")
+        if img:
+            out["image_large"] = (img.get("data-original") or img.get("src") or "").strip() or None
 
     # 3) Fallbacks por si falla el JSON (muy raro)
     if not out.get("name"):
+        if soup is None:
+            soup = BeautifulSoup(detail_html, "lxml")
         h1 = soup.select_one("h1.real-title, h1.h1, h1")
         if h1:
             out["name"] = h1.get_text(" ", strip=True)
@@ -629,6 +679,7 @@ def scrape_dryrun(
     sleep_seconds: float,
     timeout: int,
     include_details: bool,
+    workers: int,
     write_jsonl_path: Optional[str],
     affiliate_query: str,
     do_isgd: bool,
@@ -641,15 +692,21 @@ def scrape_dryrun(
     if max_products > 0:
         candidates = candidates[:max_products]
 
+    detalles: Dict[str, Union[str, Exception]] = {}
+    if include_details:
+        urls = list(dict.fromkeys(o.url for o in candidates))
+        detalles = fetch_html_many(sess, urls, timeout, sleep_seconds, workers)
+
     jsonl_file = open(write_jsonl_path, "w", encoding="utf-8") if write_jsonl_path else None
 
     try:
         for offer in candidates:
-            if sleep_seconds > 0:
-                time.sleep(sleep_seconds)
-
             if include_details:
-                detail_html = fetch_html(sess, offer.url, timeout=timeout)
+                detail_html = detalles[offer.url]
+                if isinstance(detail_html, Exception):
+                    # Igual que en secuencial: se corta en esta oferta, con las anteriores
+                    # ya impresas y escritas en el JSONL.
+                    raise detail_html
 
                 fields = parse_detail_fields(detail_html)
 
@@ -686,7 +743,7 @@ def scrape_dryrun(
             nombre_5g, nombre_limpio = build_nombre_fields(raw_name)
 
             # 3) Excluir Oukitel
-            if re.match(r"^oukitel\b", normalize_text(nombre_5g)):
+            if RE_OUKITEL.match(normalize_text(nombre_5g)):
                 continue
 
             # Clasificación (móvil / excluir tablets)
@@ -796,6 +853,7 @@ def main() -> None:
     ap.add_argument("--max-products", type=int, default=0, help="0 = sin límite")
     ap.add_argument("--sleep", type=float, default=0.7, help="segundos entre requests")
     ap.add_argument("--timeout", type=int, default=25, help="timeout por request (seg)")
+    ap.add_argument("--workers", type=int, default=4, help="fichas descargadas en paralelo")
     ap.add_argument("--no-details", action="store_true", help="no entra en fichas (menos datos, peor precisión)")
     ap.add_argument("--jsonl", default="", help="ruta para guardar JSONL (opcional). Ej: logs/powerplanet.jsonl")
     ap.add_argument(
@@ -820,6 +878,7 @@ def main() -> None:
         sleep_seconds=args.sleep,
         timeout=args.timeout,
         include_details=(not args.no_details),
+        workers=args.workers,
         write_jsonl_path=(args.jsonl.strip() or None),
         affiliate_query=args.affiliate_query.strip(),
         do_isgd=(not args.no_isgd),
@@ -173,7 +173,7 @@ def http_get(url: str) -> Optional[str]:
 
 def extract_ficha_tecnica(html_text: str) -> Dict[str, str]:
     """Extrae la tabla de 'Ficha técnica' y devuelve dict label->value."""
-    soup = BeautifulSoup(html_text, "html.parser")
+    soup = BeautifulSoup(html_text, "lxml")
 
     # Normalmente está en un <h2>Ficha técnica</h2> seguido de una tabla
     # pero para robustez buscamos cualquier <h2> que contenga "Ficha técnica".
@@ -4,8 +4,10 @@ import re
 import requests
 import urllib.parse
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from bs4 import BeautifulSoup
+from selectolax.parser import HTMLParser
 from woocommerce import API
 
 # ============================================================
@@ -58,13 +60,26 @@ wcapi = API(
     timeout=60
 )
 
+# Sesión HTTP compartida: keep-alive entre peticiones al mismo host
+# (is.gd, fichas, imágenes) en lugar de un handshake TCP+TLS por llamada.
+http_session = requests.Session()
+
+# Listados descargados a la vez (son independientes; el parseo sigue en orden)
+MAX_WORKERS_LISTADOS = 6
+# Páginas de la API de WooCommerce pedidas a la vez
+MAX_WORKERS_WC = 8
+
+# Regex precompiladas (se aplican por producto)
+RE_NO_PRECIO = re.compile(r'[^\d.]')
+RE_NUMERO = re.compile(r'(\d+)')
+
 summary_creados, summary_eliminados, summary_actualizados = [], [], []
 summary_ignorados, summary_sin_stock_nuevos, summary_fallidos = [], [], []
 
 def acortar_url(url_larga):
     try:
         url_encoded = urllib.parse.quote(url_larga)
-        r = requests.get(f"https://is.gd/create.php?format=simple&url={url_encoded}", timeout=10)
+        r = http_session.get(f"https://is.gd/create.php?format=simple&url={url_encoded}", timeout=10)
         return r.text.strip() if r.status_code == 200 else url_larga
     except:
         return url_larga
@@ -79,19 +94,59 @@ def obtener_version(nombre):
     return mapping.get(primera, "Global Version")
 
 # --- GESTIÓN DE CATEGORÍAS ---
-def obtener_todas_las_categorias():
-    categorias = []
-    page = 1
-    while True:
+def obtener_paginado_wc(recurso, params=None, estricto=False):
+    """GET paginado contra la API de WooCommerce.
+    La primera respuesta trae X-WP-TotalPages; el resto de páginas se piden en paralelo.
+    Con estricto=True cualquier página fallida (o un total que no cuadra con
+    X-WP-Total) lanza excepción en lugar de devolver una lista incompleta.
+    """
+    params = dict(params or {}, per_page=100)
+    try:
+        res = wcapi.get(recurso, params={**params, "page": 1})
+        primera = res.json()
+    except Exception:
+        if estricto:
+            raise
+        return []
+    if not isinstance(primera, list):
+        if estricto:
+            raise RuntimeError(f"Respuesta inesperada de WooCommerce en {recurso} (página 1): {str(primera)[:200]}")
+        return []
+    try:
+        total_paginas = int(res.headers.get("X-WP-TotalPages", 1))
+    except (TypeError, ValueError):
+        total_paginas = 1
+
+    def _pagina(n):
         try:
-            res = wcapi.get("products/categories", params={"per_page": 100, "page": page}).json()
-            if not res or "message" in res or len(res) == 0:
-                break
-            categorias.extend(res)
-            page += 1
-        except:
-            break
-    return categorias
+            datos = wcapi.get(recurso, params={**params, "page": n}).json()
+        except Exception:
+            if estricto:
+                raise
+            return []
+        if not isinstance(datos, list):
+            if estricto:
+                raise RuntimeError(f"Respuesta inesperada de WooCommerce en {recurso} (página {n}): {str(datos)[:200]}")
+            return []
+        return datos
+
+    resultados = list(primera)
+    if total_paginas > 1:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS_WC) as executor:
+            for datos in executor.map(_pagina, range(2, total_paginas + 1)):
+                resultados.extend(datos)
+
+    if estricto:
+        try:
+            total = int(res.headers.get("X-WP-Total", len(resultados)))
+        except (TypeError, ValueError):
+            total = len(resultados)
+        if total != len(resultados):
+            raise RuntimeError(f"Listado incompleto de {recurso}: {len(resultados)} de {total}")
+    return resultados
+
+def obtener_todas_las_categorias():
+    return obtener_paginado_wc("products/categories")
 
 def resolver_jerarquia(nombre_completo, cache_categorias):
     palabras = nombre_completo.split()
@@ -128,11 +183,21 @@ def obtener_datos_remotos():
 
     print(f"--- FASE 1: ESCANEANDO {len(URLS_PAGINAS)} PÁGINAS ---")
 
-    for idx, url in enumerate(URLS_PAGINAS, 1):
+    def _descargar_listado(url):
+        try:
+            return http_session.get(url, headers=headers, timeout=20).text, None
+        except Exception as e:
+            return "", e
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS_LISTADOS) as executor:
+        descargas = list(executor.map(_descargar_listado, URLS_PAGINAS))
+
+    for idx, (html, error_descarga) in enumerate(descargas, 1):
         try:
             print(f"   Scaneando página {idx}...")
-            r = requests.get(url, headers=headers, timeout=20)
-            soup = BeautifulSoup(r.text, 'html.parser')
+            if error_descarga:
+                raise error_descarga
+            soup = BeautifulSoup(html, 'lxml')
 
             for item in soup.select("div.product_desc"):
                 link_tag = item.select_one('h3[itemprop="name"] a')
@@ -162,18 +227,21 @@ def obtener_datos_remotos():
 
                 p_cont = item.find_next_sibling("div", class_="product-price-and-shipping") or item.parent.select_one(".product-price-and-shipping")
                 p_act_el = p_cont.select_one(".price") if p_cont else item.parent.select_one(".price")
-                p_act = int(float(re.sub(r'[^\d.]', '', p_act_el.get_text(strip=True)))) if p_act_el else 0
+                p_act = int(float(RE_NO_PRECIO.sub('', p_act_el.get_text(strip=True)))) if p_act_el else 0
 
                 p_reg_el = p_cont.select_one(".regular-price") if p_cont else None
-                p_reg = int(float(re.sub(r'[^\d.]', '', p_reg_el.get_text(strip=True)))) if p_reg_el else int(p_act * 1.1)
-
-                det_r = requests.get(url_imp, headers=headers, timeout=15)
-                det_soup = BeautifulSoup(det_r.text, 'html.parser')
-                img = det_soup.find("meta", property="og:image")["content"] if det_soup.find("meta", property="og:image") else ""
-
-                avail_tag = det_soup.select_one("#product-availability, .product-quantities")
-                stock_txt = avail_tag.get_text().strip() if avail_tag else det_soup.get_text()
-                match_stock = re.search(r'(\d+)', stock_txt)
+                p_reg = int(float(RE_NO_PRECIO.sub('', p_reg_el.get_text(strip=True)))) if p_reg_el else int(p_act * 1.1)
+
+                # Ficha: solo se leen og:image y la disponibilidad; selectolax (C) en
+                # lugar de construir el árbol BS4 completo de cada página de detalle.
+                det_r = http_session.get(url_imp, headers=headers, timeout=15)
+                det_tree = HTMLParser(det_r.content)
+                og_img = det_tree.css_first('meta[property="og:image"]')
+                img = (og_img.attributes.get("content") or "") if og_img else ""
+
+                avail_tag = det_tree.css_first("#product-availability, .product-quantities")
+                stock_txt = avail_tag.text().strip() if avail_tag else det_tree.root.text()
+                match_stock = RE_NUMERO.search(stock_txt)
                 cantidad = match_stock.group(1) if match_stock else ("Disponible" if "in stock" in stock_txt.lower() else "0")
 
                 total_productos.append({
@@ -202,21 +270,13 @@ def sincronizar(remotos):
     print(f"--- FASE 2: SINCRONIZANDO ---")
     cache_categorias = obtener_todas_las_categorias()
     locales = []
-    page = 1
-
-    while True:
-        res = wcapi.get("products", params={"per_page": 100, "page": page}).json()
-        if not res or "message" in res:
-            break
 
-        for p in res:
-            meta = {m['key']: str(m['value']) for m in p.get('meta_data', [])}
-            if "tradingshenzhen.com" in meta.get('importado_de', '').lower():
-                locales.append({"id": p['id'], "nombre": p['name'], "meta": meta})
-
-        if len(res) < 100:
-            break
-        page += 1
+    # Estricto: un listado parcial haría que los remotos ya importados se
+    # tomasen por nuevos y se duplicaran; mejor abortar la sincronización.
+    for p in obtener_paginado_wc("products", estricto=True):
+        meta = {m['key']: str(m['value']) for m in p.get('meta_data', [])}
+        if "tradingshenzhen.com" in meta.get('importado_de', '').lower():
+            locales.append({"id": p['id'], "nombre": p['name'], "meta": meta})
 
     for r in remotos:
         try: